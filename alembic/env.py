@@ -1,19 +1,31 @@
+import asyncio
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config, pool
 from alembic import context
-from database import engine
+from database import async_engine
 from models import User, Organization, OrganizationMember, Project, Asset
 from sqlmodel import SQLModel
 
 config = context.config
 fileConfig(config.config_file_name)
-connectable = engine
+connectable = async_engine
 
-with connectable.connect() as connection:
+def do_run_migrations(connection):
     context.configure(
         connection=connection,
         target_metadata=SQLModel.metadata,
         include_schemas=True
     )
     with context.begin_transaction():
-        context.run_migrations()
\ No newline at end of file
+        context.run_migrations()
+
+async def run_async_migrations():
+    # Dispose even when a migration fails, or the driver's connection thread
+    # keeps the migration process alive
+    try:
+        async with connectable.connect() as connection:
+            await connection.run_sync(do_run_migrations)
+    finally:
+        await connectable.dispose()
+
+asyncio.run(run_async_migrations())
@@ -0,0 +1,23 @@
+"""Add organization_members user index
+
+Revision ID: 2c8f5d1e7b36
+Revises: 9e3b7d52c6a1
+Create Date: 2026-10-18 14:02:51.208114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '2c8f5d1e7b36'
+down_revision: Union[str, None] = '9e3b7d52c6a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade():
+    op.create_index('ix_organization_members_user_id_organization_id', 'organization_members', ['user_id', 'organization_id'], postgresql_include=['role'])
+
+def downgrade():
+    op.drop_index('ix_organization_members_user_id_organization_id', table_name='organization_members')
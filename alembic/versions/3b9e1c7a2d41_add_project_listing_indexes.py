@@ -0,0 +1,27 @@
+"""Add project listing indexes
+
+Revision ID: 3b9e1c7a2d41
+Revises: f5c97448fef4
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e1c7a2d41'
+down_revision: Union[str, None] = 'f5c97448fef4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade():
+    op.create_index('ix_projects_owner_id_modified_at', 'projects', ['owner_id', 'modified_at'], postgresql_include=['name', 'type', 'organization_id'])
+    op.create_index('ix_projects_organization_id_modified_at', 'projects', ['organization_id', 'modified_at'], postgresql_include=['name', 'type', 'owner_id'])
+    op.create_index('ix_assets_project_id', 'assets', ['project_id'])
+
+def downgrade():
+    op.drop_index('ix_assets_project_id', table_name='assets')
+    op.drop_index('ix_projects_organization_id_modified_at', table_name='projects')
+    op.drop_index('ix_projects_owner_id_modified_at', table_name='projects')
@@ -0,0 +1,45 @@
+"""Add vector op-log and snapshots
+
+Revision ID: 5a7c2e91d0f4
+Revises: c41e7f09ab25
+Create Date: 2026-10-18 11:35:06.221874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '5a7c2e91d0f4'
+down_revision: Union[str, None] = 'c41e7f09ab25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade():
+    op.add_column('assets', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+    op.create_table(
+        'asset_operations',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('asset_id', sa.Integer(), sa.ForeignKey('assets.id'), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('op', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('asset_id', 'version', 'seq', name='uq_asset_operations_asset_id_version_seq'),
+    )
+    op.create_table(
+        'asset_snapshots',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('asset_id', sa.Integer(), sa.ForeignKey('assets.id'), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('asset_id', 'version', name='uq_asset_snapshots_asset_id_version'),
+    )
+
+def downgrade():
+    op.drop_table('asset_snapshots')
+    op.drop_table('asset_operations')
+    op.drop_column('assets', 'version')
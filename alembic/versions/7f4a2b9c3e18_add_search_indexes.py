@@ -0,0 +1,36 @@
+"""Add search indexes
+
+Revision ID: 7f4a2b9c3e18
+Revises: 2c8f5d1e7b36
+Create Date: 2026-10-18 14:31:09.640272
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '7f4a2b9c3e18'
+down_revision: Union[str, None] = '2c8f5d1e7b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Postgres only; SQLite deployments search with the in-process index (search.py).
+# The expressions must match the ones search.py queries with.
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_projects_name_tsv', 'projects', [sa.text("to_tsvector('simple', name)")], postgresql_using='gin')
+    op.create_index('ix_projects_name_trgm', 'projects', ['name'], postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_assets_content_tsv', 'assets', [sa.text("to_tsvector('simple', content)")], postgresql_using='gin', postgresql_where=sa.text("type = 'text'"))
+    op.create_index('ix_assets_content_trgm', 'assets', ['content'], postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'}, postgresql_where=sa.text("type = 'text'"))
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_assets_content_trgm', table_name='assets')
+    op.drop_index('ix_assets_content_tsv', table_name='assets')
+    op.drop_index('ix_projects_name_trgm', table_name='projects')
+    op.drop_index('ix_projects_name_tsv', table_name='projects')
@@ -0,0 +1,29 @@
+"""Add asset blob columns
+
+Revision ID: 8d2f4a6b1c93
+Revises: 3b9e1c7a2d41
+Create Date: 2026-10-18 10:02:17.447310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2f4a6b1c93'
+down_revision: Union[str, None] = '3b9e1c7a2d41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade():
+    op.add_column('assets', sa.Column('content_hash', sa.String(), nullable=True))
+    op.add_column('assets', sa.Column('mime_type', sa.String(), nullable=True))
+    op.add_column('assets', sa.Column('size', sa.Integer(), nullable=True))
+    op.create_index('ix_assets_content_hash', 'assets', ['content_hash'])
+
+def downgrade():
+    op.drop_index('ix_assets_content_hash', table_name='assets')
+    op.drop_column('assets', 'size')
+    op.drop_column('assets', 'mime_type')
+    op.drop_column('assets', 'content_hash')
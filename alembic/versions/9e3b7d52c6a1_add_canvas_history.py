@@ -0,0 +1,47 @@
+"""Add tile-based canvas history
+
+Revision ID: 9e3b7d52c6a1
+Revises: 5a7c2e91d0f4
+Create Date: 2026-10-18 12:20:44.508213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '9e3b7d52c6a1'
+down_revision: Union[str, None] = '5a7c2e91d0f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade():
+    op.create_table(
+        'canvas_history_steps',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('asset_id', sa.Integer(), sa.ForeignKey('assets.id'), nullable=False),
+        sa.Column('step', sa.Integer(), nullable=False),
+        sa.Column('tile_size', sa.Integer(), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=False),
+        sa.Column('height', sa.Integer(), nullable=False),
+        sa.Column('tile_count', sa.Integer(), nullable=False),
+        sa.Column('byte_size', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('asset_id', 'step', name='uq_canvas_history_steps_asset_id_step'),
+    )
+    op.create_table(
+        'canvas_tiles',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('step_id', sa.Integer(), sa.ForeignKey('canvas_history_steps.id'), nullable=False),
+        sa.Column('tx', sa.Integer(), nullable=False),
+        sa.Column('ty', sa.Integer(), nullable=False),
+        sa.Column('before', sa.LargeBinary(), nullable=False),
+        sa.Column('after', sa.LargeBinary(), nullable=False),
+    )
+    op.create_index('ix_canvas_tiles_step_id', 'canvas_tiles', ['step_id'])
+
+def downgrade():
+    op.drop_index('ix_canvas_tiles_step_id', table_name='canvas_tiles')
+    op.drop_table('canvas_tiles')
+    op.drop_table('canvas_history_steps')
@@ -0,0 +1,38 @@
+"""Add thumbnail jobs
+
+Revision ID: c41e7f09ab25
+Revises: 8d2f4a6b1c93
+Create Date: 2026-10-18 10:48:53.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e7f09ab25'
+down_revision: Union[str, None] = '8d2f4a6b1c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade():
+    op.create_table(
+        'thumbnail_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('asset_id', sa.Integer(), sa.ForeignKey('assets.id'), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('asset_id', 'content_hash', name='uq_thumbnail_jobs_asset_id_content_hash'),
+    )
+    op.create_index('ix_thumbnail_jobs_asset_id', 'thumbnail_jobs', ['asset_id'])
+    op.create_index('ix_thumbnail_jobs_status', 'thumbnail_jobs', ['status'])
+
+def downgrade():
+    op.drop_index('ix_thumbnail_jobs_status', table_name='thumbnail_jobs')
+    op.drop_index('ix_thumbnail_jobs_asset_id', table_name='thumbnail_jobs')
+    op.drop_table('thumbnail_jobs')
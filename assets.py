@@ -0,0 +1,290 @@
+import logging
+import os
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import BaseModel
+from sqlalchemy import delete
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from database import AsyncSessionDep
+from models import Asset, AssetOperation, AssetSnapshot
+from auth import require_user
+from authz import authorize_project
+from storage import BLOB_SECURITY_HEADERS, BlobResponse, BlobStore, BlobTooLarge, BlobWriter, DigestMismatch, blob_store
+from svg_optimize import SVG_OPTIMIZE, optimize
+from thumbnails import enqueue_thumbnail
+from user_cache import UserSnapshot
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Upload content types we accept, mapped to Asset.type
+ASSET_TYPES = {
+    "image/png": "bitmap",
+    "image/svg+xml": "vector",
+}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+MAX_FIELD_BYTES = 1024
+SVG_MEMO_SIZE = 4096
+
+class AssetBlobInfo(BaseModel):
+    id: int
+    project_id: int
+    type: str
+    content_hash: str
+    mime_type: str
+    size: int
+    deduplicated: bool
+
+class UploadedBlob(BaseModel):
+    digest: str
+    size: int
+    mime_type: str
+    deduplicated: bool
+    fields: Dict[str, str]
+
+# Collects multipart callbacks for one request. Small form fields are kept in
+# memory; the "file" part is handed to a BlobWriter in batches so the body is
+# never buffered whole. Fields sent before the file (sha256) can let the
+# writer skip disk writes entirely for content the store already has.
+class _UploadState:
+    def __init__(self, store: BlobStore):
+        self.store = store
+        self.fields: Dict[str, str] = {}
+        self.writer: Optional[BlobWriter] = None
+        self.mime_type: Optional[str] = None
+        self.head = b""
+        self.pending: List[bytes] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._name: Optional[str] = None
+        self._is_file = False
+        self._value = bytearray()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._is_file = False
+        self._value = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        self._name = options.get(b"name", b"").decode("latin-1")
+        if self._name != "file":
+            return
+        if self.writer is not None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only one file per upload")
+        content_type, _ = parse_options_header(self._headers.get(b"content-type"))
+        self.mime_type = content_type.decode("latin-1")
+        if self.mime_type not in ASSET_TYPES:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unsupported asset type")
+        self._is_file = True
+        self.writer = self.store.writer(self.fields.get("sha256"))
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._is_file:
+            chunk = data[start:end]
+            if len(self.head) < 1024:
+                self.head += chunk[:1024 - len(self.head)]
+            self.pending.append(chunk)
+        else:
+            self._value += data[start:end]
+            if len(self._value) > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Form field too large")
+
+    def on_part_end(self):
+        if not self._is_file and self._name:
+            self.fields[self._name] = self._value.decode("utf-8", "replace")
+
+    # Hand buffered file bytes to the writer off the event loop
+    async def flush(self):
+        if self.writer is not None and self.pending:
+            chunks, self.pending = self.pending, []
+            await anyio.to_thread.run_sync(self.writer.write_many, chunks)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+
+def _check_signature(mime_type: str, head: bytes) -> bool:
+    if mime_type == "image/png":
+        return head.startswith(PNG_SIGNATURE)
+    if mime_type == "image/svg+xml":
+        return b"<svg" in head or head.lstrip().startswith(b"<?xml")
+    return False
+
+# Stream a multipart request body into the blob store
+async def receive_upload(request: Request, store: BlobStore = blob_store) -> UploadedBlob:
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected multipart/form-data")
+    state = _UploadState(store)
+    parser = MultipartParser(options[b"boundary"], callbacks=state.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await state.flush()
+        parser.finalize()
+        await state.flush()
+        if state.writer is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing file part")
+        if not _check_signature(state.mime_type, state.head):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File content does not match its type")
+        digest = await anyio.to_thread.run_sync(state.writer.commit)
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except DigestMismatch as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        state.abort()
+    return UploadedBlob(
+        digest=digest,
+        size=state.writer.size,
+        mime_type=state.mime_type,
+        deduplicated=state.writer.deduplicated,
+        fields=state.fields,
+    )
+
+# Rewrite an uploaded SVG through the optimizer into a blob of its own. The
+# uploaded blob is left in the store (another asset may share it), and a
+# document the optimizer can't parse or shrink is kept as uploaded.
+def _optimize_svg_blob(upload: UploadedBlob, store: BlobStore = blob_store) -> UploadedBlob:
+    writer = store.writer()
+    try:
+        stats = optimize(store.path(upload.digest), writer.write)
+        if stats.optimized_bytes >= upload.size:
+            return upload
+        digest = writer.commit()
+    except (ET.ParseError, BlobTooLarge) as e:
+        logger.warning("Keeping unoptimized SVG %s: %s", upload.digest, e)
+        return upload
+    finally:
+        writer.abort()
+    return upload.model_copy(update={"digest": digest, "size": writer.size, "deduplicated": writer.deduplicated})
+
+# Uploaded SVG digest -> (digest, size) to store instead. Optimized outputs
+# map to themselves, so re-saving an unchanged drawing (either the original
+# or the optimized file) stays a deduplicated upload with no blob rewrite.
+_optimized_svgs: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+
+async def _optimize_svg_upload(upload: UploadedBlob) -> UploadedBlob:
+    cached = _optimized_svgs.get(upload.digest)
+    if cached is not None and blob_store.exists(cached[0]):
+        _optimized_svgs.move_to_end(upload.digest)
+        if cached[0] == upload.digest:
+            return upload
+        return upload.model_copy(update={"digest": cached[0], "size": cached[1], "deduplicated": True})
+    optimized = await anyio.to_thread.run_sync(_optimize_svg_blob, upload)
+    for digest in (upload.digest, optimized.digest):
+        _optimized_svgs[digest] = (optimized.digest, optimized.size)
+        _optimized_svgs.move_to_end(digest)
+    while len(_optimized_svgs) > SVG_MEMO_SIZE:
+        _optimized_svgs.popitem(last=False)
+    return optimized
+
+async def get_accessible_asset(session, user_id: int, asset_id: int, action: str = "view") -> Asset:
+    asset = await session.get(Asset, asset_id)
+    if asset is None or await authorize_project(session, user_id, asset.project_id, action) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset not found")
+    return asset
+
+def _asset_info(asset: Asset, deduplicated: bool) -> AssetBlobInfo:
+    return AssetBlobInfo(
+        id=asset.id,
+        project_id=asset.project_id,
+        type=asset.type,
+        content_hash=asset.content_hash,
+        mime_type=asset.mime_type,
+        size=asset.size,
+        deduplicated=deduplicated,
+    )
+
+# Upload a PNG canvas or SVG document. Send an "asset_id" field to replace an
+# existing asset and a "sha256" field (before the file) to enable dedup.
+@router.post("/api/projects/{project_id}/assets", response_model=AssetBlobInfo)
+async def upload_asset(project_id: int, request: Request, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    project = await authorize_project(session, user.id, project_id, "edit")
+    if project is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
+    upload = await receive_upload(request)
+    if upload.mime_type == "image/svg+xml" and SVG_OPTIMIZE:
+        upload = await _optimize_svg_upload(upload)
+
+    asset_id = upload.fields.get("asset_id")
+    if asset_id:
+        if not asset_id.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid asset_id")
+        asset = await session.get(Asset, int(asset_id))
+        if asset is None or asset.project_id != project_id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset not found")
+        if asset.content_hash == upload.digest and not asset.version:
+            return _asset_info(asset, True)
+        if asset.version or asset.content:
+            # The file replaces the document outright; its op-log, snapshots and
+            # mirrored content describe the old one
+            await session.exec(delete(AssetOperation).where(AssetOperation.asset_id == asset.id))
+            await session.exec(delete(AssetSnapshot).where(AssetSnapshot.asset_id == asset.id))
+            asset.version = 0
+            asset.content = None
+    else:
+        asset = Asset(project_id=project_id, type=ASSET_TYPES[upload.mime_type])
+
+    now = datetime.utcnow()
+    asset.type = ASSET_TYPES[upload.mime_type]
+    asset.file_path = blob_store.relative_path(upload.digest)
+    asset.content_hash = upload.digest
+    asset.mime_type = upload.mime_type
+    asset.size = upload.size
+    asset.modified_at = now
+    project.modified_at = now
+    session.add(asset)
+    session.add(project)
+    await session.commit()
+    await session.refresh(asset)
+    await enqueue_thumbnail(session, asset)
+    return _asset_info(asset, upload.deduplicated)
+
+@router.api_route("/api/assets/{asset_id}/blob", methods=["GET", "HEAD"])
+async def download_asset(asset_id: int, request: Request, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    asset = await get_accessible_asset(session, user.id, asset_id)
+    if not asset.content_hash or not blob_store.exists(asset.content_hash):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset has no stored file")
+    path = blob_store.path(asset.content_hash)
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    return BlobResponse(
+        path,
+        asset.content_hash,
+        asset.mime_type or "application/octet-stream",
+        stat_result.st_size,
+        stat_result.st_mtime,
+        request_headers=request.headers,
+        extra_headers=BLOB_SECURITY_HEADERS,
+    )
@@ -0,0 +1,80 @@
+from fastapi import Depends, HTTPException, Request, status
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.requests import HTTPConnection
+from database import AsyncSessionDep
+from models import User
+from user_cache import UserSnapshot, user_cache
+from dotenv import load_dotenv
+import logging
+import secrets
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# JWT configuration
+SECRET_KEY = os.getenv("SECRET_KEY") or secrets.token_urlsafe(32)
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Create JWT token. jose (and the cryptography backend) is imported on first
+# use to keep it out of worker boot.
+def create_access_token(data: dict):
+    from jose import jwt
+
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+# Read the raw JWT from the access_token cookie (works for websockets too)
+def get_token(request: HTTPConnection) -> Optional[str]:
+    token = request.cookies.get("access_token")
+    if token is None:
+        return None
+    if token.startswith("Bearer "):
+        token = token[len("Bearer "):]
+    return token
+
+# Resolve a raw JWT to a user snapshot. Decoded tokens are cached, so repeat
+# requests skip both the JWT decode and the users lookup.
+async def user_from_token(token: str, session: AsyncSession) -> Optional[UserSnapshot]:
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+    from jose import JWTError, jwt
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            logger.debug("No username in JWT payload")
+            return None
+    except JWTError as e:
+        logger.debug("JWT decode error: %s", e)
+        return None
+    user = (await session.exec(select(User).where(User.username == username))).first()
+    logger.debug("User from DB: %s", user.username if user else None)
+    if user is None:
+        return None
+    snapshot = UserSnapshot(id=user.id, username=user.username, email=user.email)
+    user_cache.set(token, snapshot, payload.get("exp"))
+    return snapshot
+
+# Dependency to get the current user from cookie
+async def get_current_user(request: Request, session: AsyncSessionDep) -> Optional[UserSnapshot]:
+    token = get_token(request)
+    if token is None:
+        return None
+    return await user_from_token(token, session)
+
+# Dependency for API routes that need a signed-in user
+async def require_user(user: Optional[UserSnapshot] = Depends(get_current_user)) -> UserSnapshot:
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return user
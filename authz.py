@@ -0,0 +1,224 @@
+import os
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from metrics import Counter
+from models import OrganizationMember, Project
+from user_cache import LocalInvalidationBackend, SQLiteInvalidationBackend
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# What each organization role may do to the organization's projects. Project
+# owners can do everything; unknown roles get the plain member rights.
+ACTIONS = ("view", "edit", "manage")
+ROLE_ACTIONS = {
+    "admin": {"view", "edit", "manage"},
+    "editor": {"view", "edit"},
+    "member": {"view"},
+}
+ROLE_RANK = {"member": 0, "editor": 1, "admin": 2}
+
+# Per-user organization -> role maps are cached so a permission check is a
+# single primary-key lookup on projects. Set AUTHZ_CACHE_SHARED_PATH to share
+# invalidations between workers on the same host (like USER_CACHE_SHARED_PATH).
+AUTHZ_CACHE_SIZE = int(os.getenv("AUTHZ_CACHE_SIZE", "10000"))
+AUTHZ_CACHE_TTL = float(os.getenv("AUTHZ_CACHE_TTL", "300"))
+AUTHZ_CACHE_SHARED_PATH = os.getenv("AUTHZ_CACHE_SHARED_PATH")
+
+AUTHZ_CACHE_LOOKUPS = Counter("authz_membership_cache_total", "Membership map lookups by result")
+
+Memberships = Dict[int, str]
+
+# Bounded LRU of user id -> memberships. Every entry remembers the version it
+# was loaded under; a membership change bumps the user's version (or the
+# global epoch for bulk changes), so a map loaded while the change was being
+# committed is never stored or served.
+class MembershipCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 300, backend=None, poll_interval: float = 1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend or LocalInvalidationBackend()
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[int, Tuple[Tuple[int, int], float, Memberships]]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._epoch = 0
+        self._last_poll = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id: int) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(user_id, 0)
+
+    def get(self, user_id: int) -> Optional[Memberships]:
+        self._sync()
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != self.version(user_id) or entry[1] <= time.monotonic():
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            AUTHZ_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        AUTHZ_CACHE_LOOKUPS.inc(result="hit")
+        return entry[2]
+
+    # `version` is what version() returned before the memberships were read
+    def set(self, user_id: int, version: Tuple[int, int], memberships: Memberships) -> None:
+        if version != self.version(user_id):
+            return
+        self._entries[user_id] = (version, time.monotonic() + self.ttl, memberships)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        self._bump(user_id)
+        self.backend.publish("members", str(user_id))
+
+    def invalidate_all(self) -> None:
+        self._bump_epoch()
+        self.backend.publish("members", "*")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _bump(self, user_id: int) -> None:
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        self._entries.pop(user_id, None)
+
+    def _bump_epoch(self) -> None:
+        self._epoch += 1
+        self._versions.clear()
+        self._entries.clear()
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+        for kind, key in self.backend.poll():
+            if kind != "members":
+                continue
+            if key == "*":
+                self._bump_epoch()
+            else:
+                self._bump(int(key))
+
+membership_cache = MembershipCache(
+    maxsize=AUTHZ_CACHE_SIZE,
+    ttl=AUTHZ_CACHE_TTL,
+    backend=SQLiteInvalidationBackend(AUTHZ_CACHE_SHARED_PATH) if AUTHZ_CACHE_SHARED_PATH else None,
+)
+
+# Organization -> role for one user, from the cache or one index-only scan of
+# ix_organization_members_user_id_organization_id
+async def memberships_for(session: AsyncSession, user_id: int) -> Memberships:
+    cached = membership_cache.get(user_id)
+    if cached is not None:
+        return cached
+    version = membership_cache.version(user_id)
+    rows = (await session.exec(
+        select(OrganizationMember.organization_id, OrganizationMember.role).where(OrganizationMember.user_id == user_id)
+    )).all()
+    memberships: Memberships = {}
+    for organization_id, role in rows:
+        # Duplicate rows keep the strongest role
+        if ROLE_RANK.get(role, 0) >= ROLE_RANK.get(memberships.get(organization_id), -1):
+            memberships[organization_id] = role
+    membership_cache.set(user_id, version, memberships)
+    return memberships
+
+def can(user_id: int, memberships: Memberships, owner_id: int, organization_id: Optional[int], action: str) -> bool:
+    if owner_id == user_id:
+        return True
+    role = memberships.get(organization_id) if organization_id is not None else None
+    if role is None:
+        return False
+    return action in ROLE_ACTIONS.get(role, ROLE_ACTIONS["member"])
+
+# Organizations whose projects the user may perform `action` on
+def organizations_allowing(memberships: Memberships, action: str = "view") -> List[int]:
+    return [
+        organization_id for organization_id, role in memberships.items()
+        if action in ROLE_ACTIONS.get(role, ROLE_ACTIONS["member"])
+    ]
+
+# Fetch a project if the user may perform `action` on it. With the membership
+# map cached this is one primary-key lookup (served from the session's
+# identity map if the project is already loaded).
+async def authorize_project(session: AsyncSession, user_id: int, project_id: int, action: str = "view") -> Optional[Project]:
+    memberships = await memberships_for(session, user_id)
+    project = await session.get(Project, project_id)
+    if project is None or not can(user_id, memberships, project.owner_id, project.organization_id, action):
+        return None
+    return project
+
+# Keep the ids the user may perform `action` on, in their original order, with
+# one query for the whole batch (dashboard listings, search results)
+async def filter_projects(session: AsyncSession, user_id: int, project_ids: Iterable[int], action: str = "view") -> List[int]:
+    ids = list(dict.fromkeys(project_ids))
+    if not ids:
+        return []
+    memberships = await memberships_for(session, user_id)
+    rows = (await session.exec(
+        select(Project.id, Project.owner_id, Project.organization_id).where(Project.id.in_(ids))
+    )).all()
+    allowed = {row.id for row in rows if can(user_id, memberships, row.owner_id, row.organization_id, action)}
+    return [project_id for project_id in ids if project_id in allowed]
+
+# Invalidate cached memberships when organization_members rows change. Changed
+# users are collected at flush and invalidated only after the commit, so a
+# concurrent request can't re-cache the pre-commit rows. Bulk UPDATE/DELETE
+# statements can't name their users, so they drop every cached map.
+_PENDING_KEY = "authz_changed_users"
+
+def _pending(session: Session) -> Set:
+    return session.info.setdefault(_PENDING_KEY, set())
+
+@event.listens_for(Session, "after_flush")
+def _collect_membership_changes(session: Session, flush_context) -> None:
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, OrganizationMember):
+            history = inspect(obj).attrs.user_id.history
+            _pending(session).update(user_id for user_id in chain(history.added, history.unchanged, history.deleted) if user_id is not None)
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_membership_changes(state) -> None:
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    mapper = state.bind_mapper
+    if mapper is None or mapper.class_ is not OrganizationMember:
+        return
+    params = state.parameters
+    rows = params if isinstance(params, list) else [params] if params else []
+    if state.is_insert and rows and all("user_id" in row for row in rows):
+        _pending(state.session).update(row["user_id"] for row in rows)
+    else:
+        _pending(state.session).add("*")
+
+@event.listens_for(Session, "after_commit")
+def _publish_membership_changes(session: Session) -> None:
+    changed = session.info.pop(_PENDING_KEY, None)
+    if not changed:
+        return
+    if "*" in changed:
+        membership_cache.invalidate_all()
+        return
+    for user_id in changed:
+        membership_cache.invalidate_user(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_membership_changes(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,117 @@
+"""Microbenchmarks for raster.py against naive per-pixel Python versions.
+
+Run from the repository root:
+
+    python benchmarks/bench_raster.py [--size 1024] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import raster  # noqa: E402
+
+# Reference implementations mirroring drawing.js: a per-pixel stack fill and
+# per-pixel loops for resize and compositing
+
+def naive_flood_fill(pixels, width, height, x, y, color):
+    target = pixels[y][x]
+    if target == color:
+        return pixels
+    stack = [(x, y)]
+    while stack:
+        px, py = stack.pop()
+        if px < 0 or px >= width or py < 0 or py >= height or pixels[py][px] != target:
+            continue
+        pixels[py][px] = color
+        stack.extend(((px + 1, py), (px - 1, py), (px, py + 1), (px, py - 1)))
+    return pixels
+
+def naive_resize_nearest(pixels, width, height, new_width, new_height):
+    return [[pixels[row * height // new_height][col * width // new_width] for col in range(new_width)] for row in range(new_height)]
+
+def naive_composite(base, layer, width, height):
+    out = []
+    for row in range(height):
+        out_row = []
+        for col in range(width):
+            sr, sg, sb, sa = layer[row][col]
+            dr, dg, db, da = base[row][col]
+            a = sa / 255 + da / 255 * (1 - sa / 255)
+            if a == 0:
+                out_row.append((0, 0, 0, 0))
+                continue
+            blend = lambda s, d: round((s * sa / 255 + d * da / 255 * (1 - sa / 255)) / a)
+            out_row.append((blend(sr, dr), blend(sg, dg), blend(sb, db), round(a * 255)))
+        out.append(out_row)
+    return out
+
+def make_canvas(size):
+    image = np.full((size, size, 4), 255, dtype=np.uint8)
+    # A few strokes so the fill has edges to respect
+    for offset in range(0, size, max(size // 8, 1)):
+        image[offset:offset + 2, : size * 3 // 4] = (0, 0, 0, 255)
+        image[:, offset:offset + 2][: size // 2] = (0, 0, 0, 255)
+    return image
+
+def to_lists(image):
+    return [[tuple(int(v) for v in px) for px in row] for row in image]
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024, help="canvas edge in pixels")
+    parser.add_argument("--naive-size", type=int, default=256, help="canvas edge for the slow reference runs")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    canvas = make_canvas(args.size)
+    small = make_canvas(args.naive_size)
+    small_lists = to_lists(small)
+    overlay = np.zeros_like(canvas)
+    overlay[..., 0] = 200
+    overlay[..., 3] = 128
+    small_overlay = to_lists(overlay[: args.naive_size, : args.naive_size])
+    seed = (args.size - 1, args.size - 1)
+    naive_seed = (args.naive_size - 1, args.naive_size - 1)
+
+    cases = [
+        ("flood_fill",
+         lambda: raster.flood_fill(canvas, *seed, (255, 0, 0, 255)),
+         lambda: naive_flood_fill([row[:] for row in small_lists], args.naive_size, args.naive_size, *naive_seed, (255, 0, 0, 255))),
+        ("resize 2x nearest",
+         lambda: raster.resize(canvas, args.size * 2, args.size * 2, "nearest"),
+         lambda: naive_resize_nearest(small_lists, args.naive_size, args.naive_size, args.naive_size * 2, args.naive_size * 2)),
+        ("resize 2x bilinear",
+         lambda: raster.resize(canvas, args.size * 2, args.size * 2, "bilinear"),
+         None),
+        ("composite",
+         lambda: raster.composite(canvas, [(overlay, 0, 0, 1.0)]),
+         lambda: naive_composite(small_lists, small_overlay, args.naive_size, args.naive_size)),
+    ]
+
+    # Naive runs use a smaller canvas; scale to the same pixel count
+    scale = (args.size / args.naive_size) ** 2
+    print(f"{'operation':<20} {'numpy (s)':>10} {'naive (s)':>12} {'speedup':>9}")
+    for name, fast, naive in cases:
+        fast_time = timed(fast, args.repeat)
+        if naive is None:
+            print(f"{name:<20} {fast_time:>10.4f} {'-':>12} {'-':>9}")
+            continue
+        naive_time = timed(naive, 1) * scale
+        print(f"{name:<20} {fast_time:>10.4f} {naive_time:>12.4f} {naive_time / fast_time:>8.1f}x")
+    print(f"(naive timings measured at {args.naive_size}px and scaled to {args.size}px)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Size reduction and throughput of svg_optimize.py on editor-style documents.
+
+Run from the repository root:
+
+    python benchmarks/bench_svg.py [--paths 2000 20000] [--precision 2] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import svg_optimize  # noqa: E402
+
+STYLES = [
+    "fill:none;stroke:#000000;stroke-width:2;stroke-linecap:round",
+    "fill:#ff8800;stroke:none",
+    "fill:none;stroke:#3366cc;stroke-width:4;stroke-linejoin:round",
+]
+
+# A drawing as svg.js saves it: full-precision float coordinates, absolute
+# path commands, selection helpers left behind, empty layers and the same
+# inline styles on most shapes
+def make_document(paths, seed=0):
+    rng = random.Random(seed)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<svg xmlns="http://www.w3.org/2000/svg" version="1.1" viewBox="0 0 2000 2000">\n']
+    for layer in range(max(paths // 500, 1)):
+        parts.append(f'  <g id="layer{layer + 1}">\n')
+        for _ in range(min(500, paths - layer * 500)):
+            x, y = rng.uniform(0, 2000), rng.uniform(0, 2000)
+            d = [f"M {x} {y}"]
+            for _ in range(rng.randint(4, 24)):
+                if rng.random() < 0.6:
+                    x, y = x + rng.uniform(-40, 40), y + rng.uniform(-40, 40)
+                    d.append(f"C {x - 10.0 / 3} {y + 20.0 / 3} {x + 5.0 / 7} {y - 1.0 / 3} {x} {y}")
+                else:
+                    x = x + rng.uniform(-40, 40)
+                    d.append(f"L {x} {y}")
+            parts.append(f'    <path d="{" ".join(d)}" style="{rng.choice(STYLES)}"/>\n')
+        parts.append(f'    <rect class="bounding-box" x="{x}" y="{y}" width="{rng.uniform(1, 99)}" height="{rng.uniform(1, 99)}"/>\n')
+        for _ in range(4):
+            parts.append(f'    <circle class="control-point" cx="{rng.uniform(0, 2000)}" cy="{rng.uniform(0, 2000)}" r="4"/>\n')
+        parts.append("    <g></g>\n  </g>\n")
+    parts.append('  <g id="empty-layer"/>\n</svg>\n')
+    return "".join(parts).encode()
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", type=int, nargs="+", default=[2000, 20000], help="paths per generated document")
+    parser.add_argument("--precision", type=int, default=svg_optimize.SVG_PRECISION)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'paths':>7} {'input (KB)':>11} {'output (KB)':>12} {'saved':>7} {'best (s)':>9} {'MB/s':>7} {'peak (KB)':>10}")
+    for paths in args.paths:
+        document = make_document(paths)
+        with tempfile.NamedTemporaryFile(suffix=".svg", delete=False) as file:
+            file.write(document)
+        try:
+            sizes = []
+            run = lambda: sizes.append(svg_optimize.optimize(file.name, lambda chunk: None, args.precision))
+            best = timed(run, args.repeat)
+            # Streaming from a file, so peak memory should not grow with the document
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            os.unlink(file.name)
+        stats = sizes[-1]
+        print(
+            f"{paths:>7} {stats.original_bytes / 1024:>11.0f} {stats.optimized_bytes / 1024:>12.0f} "
+            f"{stats.saved_ratio:>6.1%} {best:>9.3f} {stats.original_bytes / best / 1e6:>7.1f} {peak / 1024:>10.0f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Load test for the auth, dashboard and static paths against a throwaway database.
+
+Boots uvicorn on a fresh SQLite file (or --database-url), seeds users,
+organizations, projects and assets through models.py, then runs the
+scenarios with concurrent httpx clients. Run from the repository root:
+
+    python benchmarks/loadtest.py --save-baseline benchmarks/baseline.json
+    python benchmarks/loadtest.py --compare benchmarks/baseline.json
+
+With --compare the exit status is 1 when any route's p95 latency regresses
+by more than --tolerance against the baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import insert, select
+from sqlmodel import Session, SQLModel, create_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from models import Asset, Organization, OrganizationMember, Project, User  # noqa: E402
+
+PASSWORD = "benchmark-password"
+SCENARIOS = ("login", "dashboard", "register", "static")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+# Bulk-insert the fixture data. Every user shares one password hash so
+# seeding cost doesn't scale with the hash cost.
+def seed(database_url: str, users: int, orgs: int, projects_per_user: int, assets_per_project: int) -> None:
+    from passwords import get_context
+
+    engine = create_engine(database_url)
+    SQLModel.metadata.create_all(engine)
+    password_hash = get_context().hash(PASSWORD)
+    now = datetime.utcnow()
+    rng = random.Random(42)
+    with Session(engine) as session:
+        session.execute(insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": password_hash, "created_at": now}
+            for i in range(users)
+        ])
+        session.execute(insert(Organization), [{"name": f"org{i}", "created_at": now} for i in range(orgs)])
+        user_ids = list(session.execute(select(User.id)).scalars())
+        org_ids = list(session.execute(select(Organization.id)).scalars())
+        if org_ids:
+            session.execute(insert(OrganizationMember), [
+                {"user_id": user_id, "organization_id": org_ids[index % len(org_ids)], "role": "member", "joined_at": now}
+                for index, user_id in enumerate(user_ids)
+            ])
+        session.execute(insert(Project), [
+            {
+                "name": f"Project {user_id}-{n}",
+                "type": rng.choice(["Drawing", "Vector", "Flowchart"]),
+                "owner_id": user_id,
+                "organization_id": org_ids[user_id % len(org_ids)] if org_ids and n % 2 else None,
+                "created_at": now,
+                "modified_at": now - timedelta(minutes=rng.randrange(100000)),
+            }
+            for user_id in user_ids
+            for n in range(projects_per_user)
+        ])
+        if assets_per_project:
+            project_ids = list(session.execute(select(Project.id)).scalars())
+            session.execute(insert(Asset), [
+                {"project_id": project_id, "type": "bitmap", "version": 0, "created_at": now, "modified_at": now}
+                for project_id in project_ids
+                for _ in range(assets_per_project)
+            ])
+        session.commit()
+    engine.dispose()
+
+# Cookies are issued with secure=True, which httpx won't send over plain
+# http, so they are carried by hand
+def cookies_from(response: httpx.Response) -> Dict[str, str]:
+    jar = SimpleCookie()
+    for header in response.headers.get_list("set-cookie"):
+        jar.load(header)
+    return {name: morsel.value for name, morsel in jar.items() if morsel.value}
+
+def cookie_header(cookies: Dict[str, str]) -> Dict[str, str]:
+    return {"cookie": "; ".join(f'{name}="{value}"' if " " in value else f"{name}={value}" for name, value in cookies.items())}
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.wall: Dict[str, float] = {}
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, route: str, ok=(200, 303), **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            raise
+        self.latencies.setdefault(route, []).append(time.perf_counter() - start)
+        if response.status_code not in ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def summary(self) -> Dict[str, dict]:
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            values.sort()
+            scenario_wall = self.wall.get(route) or sum(values)
+            routes[route] = {
+                "requests": len(values),
+                "errors": self.errors.get(route, 0),
+                "rps": round(len(values) / scenario_wall, 2) if scenario_wall else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+        return routes
+
+async def csrf_for(client: httpx.AsyncClient, recorder: Recorder, path: str) -> Dict[str, str]:
+    response = await recorder.request(client, "GET", path, f"GET {path}")
+    return cookies_from(response)
+
+async def login(client: httpx.AsyncClient, recorder: Recorder, username: str) -> Optional[Dict[str, str]]:
+    cookies = await csrf_for(client, recorder, "/login")
+    response = await recorder.request(
+        client, "POST", "/login", "POST /login",
+        ok=(303,),
+        data={"username": username, "password": PASSWORD, "csrf_token": cookies.get("csrf_token", "")},
+        headers=cookie_header(cookies),
+    )
+    session_cookies = cookies_from(response)
+    return session_cookies if "access_token" in session_cookies else None
+
+async def run_workers(count: int, concurrency: int, job) -> float:
+    counter = iter(range(count))
+    start = time.perf_counter()
+
+    async def worker():
+        for index in counter:
+            try:
+                await job(index)
+            except httpx.HTTPError:
+                pass
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+async def scenario_login(client, recorder, args):
+    async def job(index):
+        await login(client, recorder, f"user{index % args.users}")
+    return await run_workers(args.requests, args.concurrency, job)
+
+async def scenario_dashboard(client, recorder, args):
+    # Sign in once per simulated browser; setup requests aren't reported
+    setup = Recorder()
+    sessions = []
+    for index in range(min(args.concurrency, args.users)):
+        cookies = await login(client, setup, f"user{index}")
+        if cookies:
+            sessions.append(cookies)
+    if not sessions:
+        raise RuntimeError("Could not log in any benchmark user")
+
+    async def job(index):
+        cookies = sessions[index % len(sessions)]
+        await recorder.request(client, "GET", "/dashboard", "GET /dashboard", ok=(200,), headers=cookie_header(cookies))
+    return await run_workers(args.requests, args.concurrency, job)
+
+async def scenario_register(client, recorder, args):
+    run_id = os.urandom(3).hex()
+
+    async def job(index):
+        cookies = await csrf_for(client, recorder, "/register")
+        name = f"new{run_id}{index}"
+        await recorder.request(
+            client, "POST", "/register", "POST /register",
+            ok=(303,),
+            data={"username": name, "email": f"{name}@example.com", "password": PASSWORD, "csrf_token": cookies.get("csrf_token", "")},
+            headers=cookie_header(cookies),
+        )
+    return await run_workers(args.requests, args.concurrency, job)
+
+async def scenario_static(client, recorder, args):
+    page = await client.get("/")
+    urls = sorted(set(re.findall(r'"(/static/[^"]+)"', page.text))) or ["/static/js/drawing.js"]
+    urls.append("/static/js/drawing.js")
+
+    async def job(index):
+        url = urls[index % len(urls)]
+        route = "GET /static (plain)" if url == "/static/js/drawing.js" else "GET /static (fingerprinted)"
+        await recorder.request(client, "GET", url, route, ok=(200,), headers={"accept-encoding": "br, gzip"})
+    return await run_workers(args.requests, args.concurrency, job)
+
+SCENARIO_FUNCS = {
+    "login": (scenario_login, ("GET /login", "POST /login")),
+    "dashboard": (scenario_dashboard, ("GET /dashboard",)),
+    "register": (scenario_register, ("GET /register", "POST /register")),
+    "static": (scenario_static, ("GET /static (fingerprinted)", "GET /static (plain)")),
+}
+
+def start_server(args, workdir: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": args.database_url,
+        "SECRET_KEY": "benchmark-secret",
+        "RATE_LIMIT_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "ASSET_STORAGE_DIR": os.path.join(workdir, "blobs"),
+        "THUMBNAIL_DIR": os.path.join(workdir, "thumbnails"),
+        "RASTER_CACHE_DIR": os.path.join(workdir, "raster_cache"),
+        "USER_CACHE_SHARED_PATH": "",
+    })
+    log = open(os.path.join(workdir, "server.log"), "w")
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--no-access-log"]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup; see server.log")
+            try:
+                if (await client.get("/login")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+async def run_scenarios(args, base_url: str) -> Dict[str, dict]:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        for name in args.scenarios:
+            func, routes = SCENARIO_FUNCS[name]
+            wall = await func(client, recorder, args)
+            for route in routes:
+                recorder.wall[route] = wall
+            print(f"  {name}: {wall:.2f}s")
+    return recorder.summary()
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for route, base in baseline.items():
+        now = current.get(route)
+        if now is None or not base.get("p95_ms"):
+            continue
+        ratio = now["p95_ms"] / base["p95_ms"]
+        marker = ""
+        if ratio > 1 + tolerance:
+            regressions.append(route)
+            marker = "  REGRESSION"
+        print(f"{route:<28} p95 {base['p95_ms']:>8.2f} -> {now['p95_ms']:>8.2f} ms ({ratio - 1:+.0%}){marker}")
+    return regressions
+
+def print_table(routes: Dict[str, dict]) -> None:
+    print(f"{'route':<28} {'reqs':>6} {'errs':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in routes.items():
+        print(f"{route:<28} {stats['requests']:>6} {stats['errors']:>5} {stats['rps']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="throwaway database to seed (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--orgs", type=int, default=10)
+    parser.add_argument("--projects-per-user", type=int, default=20)
+    parser.add_argument("--assets-per-project", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="allowed p95 slowdown before failing (0.20 = 20%%)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="doodledog-bench-") as workdir:
+        args.database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        print(f"Seeding {args.users} users, {args.users * args.projects_per_user} projects...")
+        seed(args.database_url, args.users, args.orgs, args.projects_per_user, args.assets_per_project)
+        port = free_port()
+        process = start_server(args, workdir, port)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            asyncio.run(wait_ready(base_url, process))
+            print("Running scenarios:")
+            routes = asyncio.run(run_scenarios(args, base_url))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    print_table(routes)
+    result = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "database": args.database_url.split(":", 1)[0],
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+        },
+        "routes": routes,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(routes, baseline["routes"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} route(s) regressed beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import base64
+import os
+import zlib
+from datetime import datetime
+from typing import List, Literal, Tuple
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import delete, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import AsyncSessionDep
+from models import Asset, CanvasHistoryStep, CanvasTile
+from assets import get_accessible_asset
+from auth import require_user
+from user_cache import UserSnapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-asset budget; the oldest steps are evicted once either limit is hit
+HISTORY_MAX_STEPS = int(os.getenv("CANVAS_HISTORY_MAX_STEPS", "200"))
+HISTORY_MAX_BYTES = int(os.getenv("CANVAS_HISTORY_MAX_BYTES", str(32 * 1024 * 1024)))
+TILE_SIZES = (64, 128, 256)
+MAX_CANVAS_EDGE = 5000  # matches the limits on drawing.html's size inputs
+
+router = APIRouter()
+
+# Tiles travel as base64. "raw" is plain RGBA; "zlib" is RGBA already
+# deflated by the client (CompressionStream("deflate")). Responses are zlib.
+class TileIn(BaseModel):
+    x: int
+    y: int
+    before: str
+    after: str
+
+class StepIn(BaseModel):
+    after_step: int = 0  # step the client is on; later (redo) steps are discarded
+    tile_size: int = 256
+    width: int
+    height: int
+    encoding: Literal["raw", "zlib"] = "raw"
+    tiles: List[TileIn]
+
+class TileOut(BaseModel):
+    x: int
+    y: int
+    data: str
+
+class StepTiles(BaseModel):
+    step: int
+    tile_size: int
+    width: int
+    height: int
+    encoding: Literal["zlib"] = "zlib"
+    tiles: List[TileOut]
+
+class StepSummary(BaseModel):
+    step: int
+    tile_count: int
+    byte_size: int
+    created_at: datetime
+
+class HistoryOut(BaseModel):
+    steps: List[StepSummary]
+    total_bytes: int
+    max_bytes: int
+    max_steps: int
+
+def _tile_bytes(step: StepIn, x: int, y: int) -> int:
+    if x < 0 or y < 0:
+        raise ValueError("Tile is outside the canvas")
+    # Edge tiles are clipped to the canvas
+    width = min(step.tile_size, step.width - x * step.tile_size)
+    height = min(step.tile_size, step.height - y * step.tile_size)
+    if width <= 0 or height <= 0:
+        raise ValueError("Tile is outside the canvas")
+    return width * height * 4
+
+def _compress_tiles(step: StepIn) -> List[Tuple[int, int, bytes, bytes]]:
+    out = []
+    for tile in step.tiles:
+        expected = _tile_bytes(step, tile.x, tile.y)
+        pair = []
+        for encoded in (tile.before, tile.after):
+            data = base64.b64decode(encoded, validate=True)
+            if step.encoding == "zlib":
+                # Bounded inflate guards against decompression bombs
+                inflater = zlib.decompressobj()
+                raw = inflater.decompress(data, expected + 1)
+                if len(raw) != expected or inflater.unconsumed_tail:
+                    raise ValueError("Tile has the wrong size")
+                pair.append(data)
+            else:
+                if len(data) != expected:
+                    raise ValueError("Tile has the wrong size")
+                pair.append(zlib.compress(data, 6))
+        out.append((tile.x, tile.y, pair[0], pair[1]))
+    return out
+
+async def _load_bitmap_asset(session: AsyncSession, user: UserSnapshot, asset_id: int, action: str = "view") -> Asset:
+    asset = await get_accessible_asset(session, user.id, asset_id, action)
+    if asset.type != "bitmap":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not a bitmap asset")
+    return asset
+
+async def _delete_steps(session: AsyncSession, step_ids: List[int]) -> None:
+    if step_ids:
+        await session.exec(delete(CanvasTile).where(CanvasTile.step_id.in_(step_ids)))
+        await session.exec(delete(CanvasHistoryStep).where(CanvasHistoryStep.id.in_(step_ids)))
+
+# Drop the oldest steps until the asset fits its step and byte budget
+async def _enforce_budget(session: AsyncSession, asset_id: int) -> None:
+    rows = (await session.exec(
+        select(CanvasHistoryStep.id, CanvasHistoryStep.byte_size)
+        .where(CanvasHistoryStep.asset_id == asset_id)
+        .order_by(CanvasHistoryStep.step.desc())
+    )).all()
+    kept_bytes = 0
+    evict = []
+    for index, (step_id, byte_size) in enumerate(rows):
+        if index >= HISTORY_MAX_STEPS or kept_bytes + byte_size > HISTORY_MAX_BYTES and index > 0:
+            evict.append(step_id)
+        else:
+            kept_bytes += byte_size
+    await _delete_steps(session, evict)
+
+# Record one action as the tiles it touched, before and after
+@router.post("/api/assets/{asset_id}/canvas-history", response_model=StepSummary)
+async def record_step(asset_id: int, body: StepIn, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    if body.tile_size not in TILE_SIZES or not 0 < body.width <= MAX_CANVAS_EDGE or not 0 < body.height <= MAX_CANVAS_EDGE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid canvas or tile size")
+    if not body.tiles:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No tiles")
+    if len({(tile.x, tile.y) for tile in body.tiles}) != len(body.tiles):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate tiles")
+    await _load_bitmap_asset(session, user, asset_id, "edit")
+    try:
+        tiles = await anyio.to_thread.run_sync(_compress_tiles, body)
+    except ValueError as e:  # includes bad base64
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e) or "Invalid tile data")
+    except zlib.error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tile data")
+
+    # Steps stay contiguous: after_step is the start or a step that exists
+    if body.after_step < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="after_step must not be negative")
+    head = (await session.exec(
+        select(func.max(CanvasHistoryStep.step)).where(CanvasHistoryStep.asset_id == asset_id)
+    )).first() or 0
+    if body.after_step > head:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"History is at step {head}; reload it and retry")
+
+    # Recording after an undo forks history: the old redo branch goes away
+    stale = (await session.exec(
+        select(CanvasHistoryStep.id).where(CanvasHistoryStep.asset_id == asset_id, CanvasHistoryStep.step > body.after_step)
+    )).all()
+    await _delete_steps(session, list(stale))
+
+    byte_size = sum(len(before) + len(after) for _, _, before, after in tiles)
+    step = CanvasHistoryStep(
+        asset_id=asset_id,
+        step=body.after_step + 1,
+        tile_size=body.tile_size,
+        width=body.width,
+        height=body.height,
+        tile_count=len(tiles),
+        byte_size=byte_size,
+    )
+    session.add(step)
+    try:
+        await session.flush()
+        await session.exec(insert(CanvasTile).values([
+            {"step_id": step.id, "tx": x, "ty": y, "before": before, "after": after}
+            for x, y, before, after in tiles
+        ]))
+        await _enforce_budget(session, asset_id)
+        await session.commit()
+    except IntegrityError:
+        # Another client recorded the same step first
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="History changed; reload it and retry")
+    return StepSummary(step=step.step, tile_count=step.tile_count, byte_size=step.byte_size, created_at=step.created_at)
+
+@router.get("/api/assets/{asset_id}/canvas-history", response_model=HistoryOut)
+async def list_steps(asset_id: int, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    await _load_bitmap_asset(session, user, asset_id)
+    steps = (await session.exec(
+        select(CanvasHistoryStep).where(CanvasHistoryStep.asset_id == asset_id).order_by(CanvasHistoryStep.step)
+    )).all()
+    return HistoryOut(
+        steps=[StepSummary(step=s.step, tile_count=s.tile_count, byte_size=s.byte_size, created_at=s.created_at) for s in steps],
+        total_bytes=sum(s.byte_size for s in steps),
+        max_bytes=HISTORY_MAX_BYTES,
+        max_steps=HISTORY_MAX_STEPS,
+    )
+
+# Undo returns each tile's "before" pixels, redo its "after" pixels
+@router.get("/api/assets/{asset_id}/canvas-history/{step}/{direction}", response_model=StepTiles)
+async def step_tiles(asset_id: int, step: int, direction: Literal["undo", "redo"], session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    await _load_bitmap_asset(session, user, asset_id)
+    history_step = (await session.exec(
+        select(CanvasHistoryStep).where(CanvasHistoryStep.asset_id == asset_id, CanvasHistoryStep.step == step)
+    )).first()
+    if history_step is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Step not found or evicted")
+    column = CanvasTile.before if direction == "undo" else CanvasTile.after
+    rows = (await session.exec(
+        select(CanvasTile.tx, CanvasTile.ty, column).where(CanvasTile.step_id == history_step.id)
+    )).all()
+    return StepTiles(
+        step=history_step.step,
+        tile_size=history_step.tile_size,
+        width=history_step.width,
+        height=history_step.height,
+        tiles=[TileOut(x=x, y=y, data=base64.b64encode(data).decode()) for x, y, data in rows],
+    )
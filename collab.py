@@ -0,0 +1,345 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from database import DATABASE_URL, async_session_maker
+from auth import get_token, user_from_token
+from authz import authorize_project, can, memberships_for
+from user_cache import UserSnapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Collaboration channel settings
+COLLAB_BACKEND = os.getenv("COLLAB_BACKEND", "local")  # "local" or "postgres"
+COLLAB_FRAME_INTERVAL = float(os.getenv("COLLAB_FRAME_INTERVAL", "0.033"))  # ~30 frames/s
+COLLAB_CLIENT_QUEUE = int(os.getenv("COLLAB_CLIENT_QUEUE", "64"))  # frames buffered per client
+COLLAB_MAX_RESYNCS = 3  # overflows tolerated before a client is disconnected
+COLLAB_MAX_MESSAGE_BYTES = 64 * 1024
+COLLAB_RECONNECT_MAX_DELAY = 30.0  # seconds between LISTEN reconnect attempts, at most
+# Event types only the server sends; clients can't impersonate them
+RESERVED_EVENT_TYPES = {"welcome", "join", "leave", "resync", "batch"}
+
+router = APIRouter()
+
+# Cross-worker fan-out. Backends carry already-coalesced frames; each worker
+# delivers frames from its own clients locally and skips its own echoes.
+class LocalBackend:
+    def __init__(self):
+        self.deliver: Optional[Callable[[int, dict], None]] = None
+
+    async def start(self, deliver: Callable[[int, dict], None]) -> None:
+        self.deliver = deliver
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, project_id: int, frame: dict) -> None:
+        pass
+
+# LISTEN/NOTIFY on the app database, for several workers or hosts. Frames
+# larger than the NOTIFY payload limit are split by event. A lost LISTEN
+# connection is re-established with backoff; frames sent meanwhile are missed.
+class PostgresNotifyBackend:
+    channel = "doodledog_collab"
+    max_payload = 7900
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn.replace("postgresql+asyncpg://", "postgresql://").replace("postgres://", "postgresql://")
+        self.worker_id = secrets.token_hex(8)
+        self._listen_conn = None
+        self._publish_conn = None
+        self._publish_lock = asyncio.Lock()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self.deliver = None
+
+    async def start(self, deliver: Callable[[int, dict], None]) -> None:
+        import asyncpg
+
+        self.deliver = deliver
+        self._publish_conn = await asyncpg.connect(self.dsn)
+        await self._listen()
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(self._on_listen_lost)
+        await conn.add_listener(self.channel, self._on_notify)
+        self._listen_conn = conn
+
+    def _on_listen_lost(self, connection) -> None:
+        if self.deliver is None or connection is not self._listen_conn or self._reconnect_task is not None:
+            return
+        logger.warning("Collab LISTEN connection lost; reconnecting")
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 1.0
+        try:
+            while self.deliver is not None:
+                try:
+                    await self._listen()
+                    logger.info("Collab LISTEN connection restored")
+                    return
+                except Exception as e:
+                    logger.warning("Collab LISTEN reconnect failed (%s); retrying in %.0fs", e, delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, COLLAB_RECONNECT_MAX_DELAY)
+        finally:
+            self._reconnect_task = None
+
+    async def stop(self) -> None:
+        self.deliver = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None:
+                await conn.close()
+        self._listen_conn = self._publish_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        message = json.loads(payload)
+        if message.get("origin") != self.worker_id and self.deliver is not None:
+            self.deliver(message["project_id"], message["frame"])
+
+    async def publish(self, project_id: int, frame: dict) -> None:
+        payloads = []
+        pending: List[dict] = []
+        for event in frame["events"]:
+            candidate = self._encode(project_id, pending + [event])
+            if len(candidate) > self.max_payload and pending:
+                payloads.append(self._encode(project_id, pending))
+                pending = [event]
+            else:
+                pending.append(event)
+        if pending:
+            payload = self._encode(project_id, pending)
+            if len(payload) <= self.max_payload:
+                payloads.append(payload)
+            else:
+                logger.warning("Collab event too large for NOTIFY (%d bytes), not shared across workers", len(payload))
+        async with self._publish_lock:
+            if self._publish_conn.is_closed():
+                import asyncpg
+
+                self._publish_conn = await asyncpg.connect(self.dsn)
+            for payload in payloads:
+                await self._publish_conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    def _encode(self, project_id: int, events: List[dict]) -> str:
+        return json.dumps({"origin": self.worker_id, "project_id": project_id, "frame": {"type": "batch", "events": events}}, separators=(",", ":"))
+
+# One connected editor. Outgoing frames go through a bounded queue drained by
+# a sender task; a client that falls behind has its queue dropped and is told
+# to resync from the stored document instead of growing memory.
+class CollabClient:
+    def __init__(self, websocket: WebSocket, user: UserSnapshot, max_queue: int = COLLAB_CLIENT_QUEUE):
+        self.websocket = websocket
+        self.user = user
+        self.id = secrets.token_hex(6)
+        self.max_queue = max_queue
+        self.queue: Deque[str] = deque()
+        self.ready = asyncio.Event()
+        self.resyncs = 0
+        self.closed = False
+        self.dropped_frames = 0
+
+    def enqueue(self, text: str) -> None:
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            self.dropped_frames += len(self.queue)
+            self.queue.clear()
+            self.resyncs += 1
+            if self.resyncs > COLLAB_MAX_RESYNCS:
+                self.closed = True
+            else:
+                self.queue.append(json.dumps({"type": "resync"}))
+        else:
+            self.queue.append(text)
+        self.ready.set()
+
+    async def sender(self) -> None:
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                await self.websocket.send_text(self.queue.popleft())
+            if self.closed:
+                await self.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+
+# Per-project room. Incoming events are coalesced for one frame interval:
+# pointer moves keep only the latest position per client, consecutive stroke
+# segments with the same stroke_id are merged, everything else keeps order.
+class Room:
+    def __init__(self, hub: "CollabHub", project_id: int):
+        self.hub = hub
+        self.project_id = project_id
+        self.clients: Set[CollabClient] = set()
+        self._events: List[dict] = []
+        self._pointers: Dict[str, dict] = {}
+        self._strokes: Dict[str, dict] = {}  # open stroke per sender
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def add_event(self, event: dict) -> None:
+        kind = event.get("type")
+        if kind == "pointer":
+            self._pointers[event["sender"]] = event
+        elif kind == "stroke" and isinstance(event.get("points"), list) and "stroke_id" in event:
+            current = self._strokes.get(event["sender"])
+            if current is not None and current["stroke_id"] == event["stroke_id"]:
+                current["points"].extend(event["points"])
+            else:
+                event = dict(event, points=list(event["points"]))
+                self._strokes[event["sender"]] = event
+                self._events.append(event)
+        else:
+            # Later segments must not jump ahead of this sender's other events
+            self._strokes.pop(event.get("sender"), None)
+            self._events.append(event)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.hub.frame_interval, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        events = self._events + list(self._pointers.values())
+        self._events, self._pointers, self._strokes = [], {}, {}
+        if not events:
+            return
+        frame = {"type": "batch", "events": events}
+        self.broadcast(frame)
+        self.hub.schedule_publish(self.project_id, frame)
+
+    def broadcast(self, frame: dict) -> None:
+        text = json.dumps(frame, separators=(",", ":"))
+        for client in list(self.clients):
+            client.enqueue(text)
+
+    def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+class CollabHub:
+    def __init__(self, backend=None, frame_interval: float = COLLAB_FRAME_INTERVAL):
+        self.backend = backend or LocalBackend()
+        self.frame_interval = frame_interval
+        self.rooms: Dict[int, Room] = {}
+        self._publish_tasks: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        await self.backend.start(self.deliver)
+
+    async def stop(self) -> None:
+        for room in self.rooms.values():
+            room.close()
+        await self.backend.stop()
+
+    def join(self, project_id: int, client: CollabClient) -> Room:
+        room = self.rooms.get(project_id)
+        if room is None:
+            room = self.rooms[project_id] = Room(self, project_id)
+        room.clients.add(client)
+        return room
+
+    def leave(self, project_id: int, client: CollabClient) -> None:
+        room = self.rooms.get(project_id)
+        if room is None:
+            return
+        room.clients.discard(client)
+        if not room.clients:
+            room.close()
+            del self.rooms[project_id]
+
+    # Frames arriving from other workers
+    def deliver(self, project_id: int, frame: dict) -> None:
+        room = self.rooms.get(project_id)
+        if room is not None:
+            room.broadcast(frame)
+
+    def schedule_publish(self, project_id: int, frame: dict) -> None:
+        task = asyncio.create_task(self.backend.publish(project_id, frame))
+        self._publish_tasks.add(task)
+        task.add_done_callback(self._publish_tasks.discard)
+
+    def stats(self) -> dict:
+        clients = [client for room in self.rooms.values() for client in room.clients]
+        return {
+            "rooms": len(self.rooms),
+            "clients": len(clients),
+            "queued_frames": sum(len(client.queue) for client in clients),
+            "dropped_frames": sum(client.dropped_frames for client in clients),
+        }
+
+def _make_backend():
+    if COLLAB_BACKEND == "postgres":
+        return PostgresNotifyBackend(DATABASE_URL)
+    return LocalBackend()
+
+collab_hub = CollabHub(_make_backend())
+
+def _parse_event(text: str) -> Optional[Dict[str, Any]]:
+    if len(text) > COLLAB_MAX_MESSAGE_BYTES:
+        return None
+    try:
+        event = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or not isinstance(event.get("type"), str) or event["type"] in RESERVED_EVENT_TYPES:
+        return None
+    return event
+
+# Editors connect here with their normal session cookie. Each JSON message
+# needs a "type"; "pointer" and "stroke" events are coalesced into frames.
+# Anyone who can view the project may join, but only "pointer" events from
+# clients without edit rights are relayed.
+@router.websocket("/ws/projects/{project_id}")
+async def project_channel(websocket: WebSocket, project_id: int):
+    token = get_token(websocket)
+    async with async_session_maker() as session:
+        user = await user_from_token(token, session) if token else None
+        project = await authorize_project(session, user.id, project_id) if user else None
+        can_edit = project is not None and can(
+            user.id, await memberships_for(session, user.id), project.owner_id, project.organization_id, "edit"
+        )
+    if user is None or project is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    client = CollabClient(websocket, user)
+    room = collab_hub.join(project_id, client)
+    sender = asyncio.create_task(client.sender())
+    client.enqueue(json.dumps({"type": "welcome", "client_id": client.id, "can_edit": can_edit}))
+    room.add_event({"type": "join", "sender": client.id, "user": user.username})
+    try:
+        while not client.closed:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            # Binary frames aren't part of the protocol
+            event = _parse_event(message["text"]) if message.get("text") is not None else None
+            # View-only members may follow along and show their pointer
+            if event is None or (not can_edit and event["type"] != "pointer"):
+                continue
+            event["sender"] = client.id
+            event["user"] = user.username
+            room.add_event(event)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        collab_hub.leave(project_id, client)
+        if collab_hub.rooms.get(project_id) is room:
+            room.add_event({"type": "leave", "sender": client.id, "user": user.username})
+        sender.cancel()
+        # Collect the sender's outcome (e.g. a send after the client went away)
+        await asyncio.gather(sender, return_exceptions=True)
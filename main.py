@@ -1,41 +1,74 @@
+import time
+
+_boot_started = time.perf_counter()
+
 from fastapi import FastAPI, Request, Form, HTTPException, Depends, status
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from passlib.context import CryptContext
 from typing import Optional
-from sqlmodel import select, Session
-from database import create_db_and_tables, SessionDep
+from sqlmodel import select
+from database import AsyncSessionDep, prepare_schema, prewarm_pool
 from models import User
+from passwords import hash_password, verify_password, HashingBusy
+import passwords
+from auth import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, get_current_user, get_token, require_user
+from user_cache import UserSnapshot, user_cache
+from projects import ProjectPage, list_projects
+import assets
+import thumbnails
+import vector_ops
+import collab
+import raster
+import canvas_history
+import search
+import project_archive
+import metrics
+from collab import collab_hub
+from static_assets import PrecompressedStaticFiles, StaticManifest, load_static
+import templating
+from thumbnails import thumbnail_worker
 from pydantic import BaseModel, EmailStr, validator
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from datetime import datetime
+from ratelimit import limiter
 from dotenv import load_dotenv
-import secrets
+import logging
 import os
+import secrets
 
 load_dotenv()
+metrics.configure_logging()
+logger = logging.getLogger(__name__)
+metrics.startup_profile.record("imports", time.perf_counter() - _boot_started)
 app = FastAPI()
 
-# Mount static files directory for CSS/JS/images
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Route latency, per-request query counts and optional Server-Timing
+app.add_middleware(metrics.MetricsMiddleware)
+app.include_router(metrics.router)
 
-# Set up Jinja2 templates
-templates = Jinja2Templates(directory="templates")
+# Mount static files directory for CSS/JS/images. Fingerprinted copies are
+# built by `python static_assets.py` at deploy time (STATIC_PREBUILT=true),
+# or here when running locally.
+with metrics.startup_profile.phase("static assets"):
+    static_manifest = StaticManifest(load_static())
+app.mount("/static", PrecompressedStaticFiles(directory="static", manifest=static_manifest), name="static")
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Asset upload/download API
+app.include_router(assets.router)
+app.include_router(thumbnails.router)
+app.include_router(vector_ops.router)
+app.include_router(collab.router)
+app.include_router(raster.router)
+app.include_router(canvas_history.router)
+app.include_router(search.router)
+app.include_router(project_archive.router)
 
-# JWT configuration
-SECRET_KEY = os.getenv("SECRET_KEY") or secrets.token_urlsafe(32)
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Set up Jinja2 templates (bytecode cache, fragment cache, render timing)
+templates = templating.create_templates()
+templates.env.globals["static_url"] = static_manifest.url
 
-# Rate limiting
-limiter = Limiter(key_func=get_remote_address)
-app.state.limiter = limiter
+# Rate limits, shared across workers when RATE_LIMIT_STORE=sqlite
+# (RATE_LIMIT_ENABLED=false for load tests)
+LOGIN_RATE_LIMIT = os.getenv("LOGIN_RATE_LIMIT", "5/minute")
+REGISTER_RATE_LIMIT = os.getenv("REGISTER_RATE_LIMIT", "5/minute")
 
 # Pydantic models for input validation
 class UserLogin(BaseModel):
@@ -59,55 +92,35 @@ class UserRegister(BaseModel):
             raise ValueError("Password must be at least 8 characters")
         return v
 
-# Sample project data (to be replaced with database)
-projects = [
-    {"name": "Sample Workflow Process", "type": "Flowchart", "modified_date": "2025-04-10 17:30:25"},
-    {"name": "Sample Logo Design", "type": "Vector", "modified_date": "2025-04-05 09:45:32"},
-    {"name": "Sample Marketing Brochure", "type": "Page Layout", "modified_date": "2025-03-30 12:18:45"}
-]
-
-# Initialize database and tables on startup
+# Check (or create) the schema, warm caches and start background workers.
+# Each phase is timed and the breakdown is logged once the worker is ready.
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    with metrics.startup_profile.phase("schema"):
+        await prepare_schema()
+    with metrics.startup_profile.phase("templates"):
+        templating.warm_up(templates)
+    with metrics.startup_profile.phase("db pool"):
+        await prewarm_pool()
+    with metrics.startup_profile.phase("workers"):
+        thumbnail_worker.start()
+        await collab_hub.start()
+    metrics.startup_profile.report(time.perf_counter() - _boot_started)
 
-# Create JWT token
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+@app.on_event("shutdown")
+async def on_shutdown():
+    await thumbnail_worker.stop()
+    await collab_hub.stop()
+    raster.shutdown()
+    passwords.shutdown()
 
 # Generate CSRF token
 def generate_csrf_token():
     return secrets.token_urlsafe(32)
 
-# Dependency to get the current user from cookie
-async def get_current_user(request: Request, session: SessionDep):
-    print(f"Cookies: {request.cookies}")  # Debug print
-    token = request.cookies.get("access_token")
-    print(f"Raw token from cookie: {token}")  # Debug print
-    if token is None:
-        return None
-    if token.startswith("Bearer "):
-        token = token[len("Bearer "):]
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            print("No username in JWT payload")  # Debug print
-            return None
-    except JWTError as e:
-        print(f"JWT decode error: {str(e)}")  # Debug print
-        return None
-    user = session.exec(select(User).where(User.username == username)).first()
-    print(f"User from DB: {user.username if user else None}")  # Debug print
-    return user
-
 @app.get("/", response_class=HTMLResponse)
 @app.get("/home", response_class=HTMLResponse)
-async def read_root(request: Request, user: Optional[User] = Depends(get_current_user)):
+async def read_root(request: Request, user: Optional[UserSnapshot] = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
     csrf_token = generate_csrf_token()
@@ -116,17 +129,28 @@ async def read_root(request: Request, user: Optional[User] = Depends(get_current
     return response
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, user: Optional[User] = Depends(get_current_user)):
-    print(f"Dashboard user: {user.username if user else None}")  # Debug print
+async def dashboard(request: Request, session: AsyncSessionDep, cursor: Optional[str] = None, user: Optional[UserSnapshot] = Depends(get_current_user)):
+    logger.debug("Dashboard user: %s", user.username if user else None)
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
+    try:
+        page = await list_projects(session, user.id, cursor)
+    except ValueError:
+        return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
     csrf_token = generate_csrf_token()
-    response = templates.TemplateResponse("dashboard.html", {"request": request, "projects": projects, "user": user, "csrf_token": csrf_token})
+    response = templates.TemplateResponse("dashboard.html", {"request": request, "projects": page.items, "next_cursor": page.next_cursor, "user": user, "csrf_token": csrf_token})
     response.set_cookie(key="csrf_token", value=csrf_token, httponly=True, secure=True, samesite="strict")
     return response
 
+@app.get("/api/projects", response_model=ProjectPage)
+async def api_projects(session: AsyncSessionDep, cursor: Optional[str] = None, limit: int = 25, user: UserSnapshot = Depends(require_user)):
+    try:
+        return await list_projects(session, user.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+async def login_page(request: Request, user: Optional[UserSnapshot] = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
     csrf_token = generate_csrf_token()
@@ -134,9 +158,11 @@ async def login_page(request: Request, user: Optional[User] = Depends(get_curren
     response.set_cookie(key="csrf_token", value=csrf_token, httponly=True, secure=True, samesite="strict")
     return response
 
-@app.post("/login", response_class=HTMLResponse)
-@limiter.limit("5/minute")
-async def login(request: Request, session: SessionDep, username: str = Form(...), password: str = Form(...), csrf_token: str = Form(...)):
+@app.post("/login", response_class=HTMLResponse, dependencies=[
+    Depends(limiter.limit(LOGIN_RATE_LIMIT)),
+    Depends(limiter.limit(LOGIN_RATE_LIMIT, key="username")),
+])
+async def login(request: Request, session: AsyncSessionDep, username: str = Form(...), password: str = Form(...), csrf_token: str = Form(...)):
     # Verify CSRF token
     stored_csrf_token = request.cookies.get("csrf_token")
     if not stored_csrf_token or stored_csrf_token != csrf_token:
@@ -147,14 +173,23 @@ async def login(request: Request, session: SessionDep, username: str = Form(...)
     except ValueError as e:
         return templates.TemplateResponse("login.html", {"request": request, "error": str(e), "csrf_token": generate_csrf_token()})
 
-    user = session.exec(select(User).where(User.username == user_input.username)).first()
-    if not user or not pwd_context.verify(user_input.password, user.password):
+    user = (await session.exec(select(User).where(User.username == user_input.username))).first()
+    if not user:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password", "csrf_token": generate_csrf_token()})
+    try:
+        valid, new_hash = await verify_password(user_input.password, user.password)
+    except HashingBusy:
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Server is busy, please try again", "csrf_token": generate_csrf_token()}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not valid:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password", "csrf_token": generate_csrf_token()})
     
-    # Update last_login
+    # Update last_login, upgrading legacy hashes in the same commit
     user.last_login = datetime.utcnow()
+    if new_hash:
+        user.password = new_hash
     session.add(user)
-    session.commit()
+    await session.commit()
+    user_cache.invalidate_user(user.username)
 
     # Create JWT token
     access_token = create_access_token(data={"sub": user.username})
@@ -172,7 +207,7 @@ async def login(request: Request, session: SessionDep, username: str = Form(...)
     return response
 
 @app.get("/register", response_class=HTMLResponse)
-async def register_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+async def register_page(request: Request, user: Optional[UserSnapshot] = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
     csrf_token = request.cookies.get("csrf_token") or generate_csrf_token()
@@ -180,48 +215,48 @@ async def register_page(request: Request, user: Optional[User] = Depends(get_cur
     response.set_cookie(key="csrf_token", value=csrf_token, httponly=True, secure=True, samesite="strict")
     return response
 
-@app.post("/register", response_class=HTMLResponse)
-@limiter.limit("5/minute")
-async def register(request: Request, session: SessionDep, username: str = Form(...), email: str = Form(...), password: str = Form(...), csrf_token: str = Form(...)):
+@app.post("/register", response_class=HTMLResponse, dependencies=[Depends(limiter.limit(REGISTER_RATE_LIMIT))])
+async def register(request: Request, session: AsyncSessionDep, username: str = Form(...), email: str = Form(...), password: str = Form(...), csrf_token: str = Form(...)):
     # Verify CSRF token
     stored_csrf_token = request.cookies.get("csrf_token")
-    print(f"Form CSRF token: {csrf_token}, Cookie CSRF token: {stored_csrf_token}")  # Debug print
     if not stored_csrf_token or stored_csrf_token != csrf_token:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid CSRF token")
 
     try:
         user_input = UserRegister(username=username, email=email, password=password)
     except ValueError as e:
-        print(f"Validation error: {str(e)}")  # Debug print
+        logger.debug("Registration validation error: %s", e)
         return templates.TemplateResponse("register.html", {"request": request, "error": str(e), "csrf_token": generate_csrf_token()})
 
     # Check if username or email already exists
-    existing_user = session.exec(select(User).where(User.username == user_input.username)).first()
+    existing_user = (await session.exec(select(User).where(User.username == user_input.username))).first()
     if existing_user:
-        print(f"Username {username} already exists")  # Debug print
+        logger.debug("Username %s already exists", username)
         return templates.TemplateResponse("register.html", {"request": request, "error": "Username already exists", "csrf_token": generate_csrf_token()})
     
-    existing_email = session.exec(select(User).where(User.email == user_input.email)).first()
+    existing_email = (await session.exec(select(User).where(User.email == user_input.email))).first()
     if existing_email:
-        print(f"Email {email} already exists")  # Debug print
+        logger.debug("Email %s already exists", email)
         return templates.TemplateResponse("register.html", {"request": request, "error": "Email already exists", "csrf_token": generate_csrf_token()})
     
     # Hash the password and store the user
-    hashed_password = pwd_context.hash(user_input.password)
+    try:
+        hashed_password = await hash_password(user_input.password)
+    except HashingBusy:
+        return templates.TemplateResponse("register.html", {"request": request, "error": "Server is busy, please try again", "csrf_token": generate_csrf_token()}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     new_user = User(username=user_input.username, email=user_input.email, password=hashed_password, created_at=datetime.utcnow())
     session.add(new_user)
     try:
-        session.commit()
-        session.refresh(new_user)
-        print(f"User {new_user.username} saved successfully, ID: {new_user.id}")  # Debug print
-    except Exception as e:
-        session.rollback()
-        print(f"Database error: {str(e)}")  # Debug print
+        await session.commit()
+        await session.refresh(new_user)
+        logger.info("Registered user %s (id %s)", new_user.username, new_user.id)
+    except Exception:
+        await session.rollback()
+        logger.exception("Failed to save new user")
         return templates.TemplateResponse("register.html", {"request": request, "error": "Failed to save user", "csrf_token": generate_csrf_token()})
     
     # Create JWT token
     access_token = create_access_token(data={"sub": new_user.username})
-    print(f"JWT token created: {access_token}")  # Debug print
     
     # Set secure cookie with JWT
     response = RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
@@ -233,18 +268,20 @@ async def register(request: Request, session: SessionDep, username: str = Form(.
         samesite="strict",
         max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60
     )
-    print("Access token cookie set")  # Debug print
     return response
 
 @app.get("/logout", response_class=HTMLResponse)
-async def logout():
+async def logout(request: Request):
+    token = get_token(request)
+    if token:
+        user_cache.invalidate_token(token)
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="csrf_token")
     return response
 
 @app.get("/drawing", response_class=HTMLResponse)
-async def drawing_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+async def drawing_page(request: Request, user: Optional[UserSnapshot] = Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     csrf_token = generate_csrf_token()
@@ -253,7 +290,7 @@ async def drawing_page(request: Request, user: Optional[User] = Depends(get_curr
     return response
 
 @app.get("/vector", response_class=HTMLResponse)
-async def drawing_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+async def drawing_page(request: Request, user: Optional[UserSnapshot] = Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     csrf_token = generate_csrf_token()
@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import DDL, Column, Index, LargeBinary, UniqueConstraint, event, text
 from typing import Optional, List
 from datetime import datetime
 
@@ -23,6 +24,9 @@ class Organization(SQLModel, table=True):
 
 class OrganizationMember(SQLModel, table=True):
     __tablename__ = "organization_members"
+    __table_args__ = (
+        Index("ix_organization_members_user_id_organization_id", "user_id", "organization_id", postgresql_include=["role"]),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="users.id")
     organization_id: int = Field(foreign_key="organizations.id")
@@ -33,6 +37,13 @@ class OrganizationMember(SQLModel, table=True):
 
 class Project(SQLModel, table=True):
     __tablename__ = "projects"
+    __table_args__ = (
+        Index("ix_projects_owner_id_modified_at", "owner_id", "modified_at", postgresql_include=["name", "type", "organization_id"]),
+        Index("ix_projects_organization_id_modified_at", "organization_id", "modified_at", postgresql_include=["name", "type", "owner_id"]),
+        # Search indexes (migration 7f4a2b9c3e18); Postgres only
+        Index("ix_projects_name_tsv", text("to_tsvector('simple', name)"), postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_projects_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     type: str  # e.g., "Flowchart", "Vector", "Page Layout"
@@ -46,11 +57,87 @@ class Project(SQLModel, table=True):
 
 class Asset(SQLModel, table=True):
     __tablename__ = "assets"
+    __table_args__ = (
+        Index("ix_assets_content_tsv", text("to_tsvector('simple', content)"), postgresql_using="gin", postgresql_where=text("type = 'text'")).ddl_if(dialect="postgresql"),
+        Index("ix_assets_content_trgm", "content", postgresql_using="gin", postgresql_ops={"content": "gin_trgm_ops"}, postgresql_where=text("type = 'text'")).ddl_if(dialect="postgresql"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    project_id: int = Field(foreign_key="projects.id")
+    project_id: int = Field(foreign_key="projects.id", index=True)
     type: str  # e.g., "text", "bitmap", "vector"
     content: Optional[str] = Field(default=None)  # For text content
     file_path: Optional[str] = Field(default=None)  # For image/vector files
+    content_hash: Optional[str] = Field(default=None, index=True)  # SHA-256 of the stored blob
+    mime_type: Optional[str] = Field(default=None)
+    size: Optional[int] = Field(default=None)
+    version: int = Field(default=0)  # Latest op-log version for vector documents
     created_at: datetime = Field(default_factory=datetime.utcnow)
     modified_at: datetime = Field(default_factory=datetime.utcnow)
-    project: Project = Relationship(back_populates="assets")
\ No newline at end of file
+    project: Project = Relationship(back_populates="assets")
+
+class ThumbnailJob(SQLModel, table=True):
+    __tablename__ = "thumbnail_jobs"
+    __table_args__ = (
+        UniqueConstraint("asset_id", "content_hash", name="uq_thumbnail_jobs_asset_id_content_hash"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    asset_id: int = Field(foreign_key="assets.id", index=True)
+    content_hash: str
+    status: str = Field(default="pending", index=True)  # "pending", "running", "done", "failed"
+    attempts: int = Field(default=0)
+    error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class AssetOperation(SQLModel, table=True):
+    __tablename__ = "asset_operations"
+    __table_args__ = (
+        UniqueConstraint("asset_id", "version", "seq", name="uq_asset_operations_asset_id_version_seq"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    asset_id: int = Field(foreign_key="assets.id")
+    version: int
+    seq: int  # Position of the op within its version's batch
+    op: str  # JSON-encoded edit operation
+    user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class AssetSnapshot(SQLModel, table=True):
+    __tablename__ = "asset_snapshots"
+    __table_args__ = (
+        UniqueConstraint("asset_id", "version", name="uq_asset_snapshots_asset_id_version"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    asset_id: int = Field(foreign_key="assets.id")
+    version: int
+    content: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class CanvasHistoryStep(SQLModel, table=True):
+    __tablename__ = "canvas_history_steps"
+    __table_args__ = (
+        UniqueConstraint("asset_id", "step", name="uq_canvas_history_steps_asset_id_step"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    asset_id: int = Field(foreign_key="assets.id")
+    step: int
+    tile_size: int
+    width: int
+    height: int
+    tile_count: int
+    byte_size: int  # Compressed bytes stored for this step's tiles
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CanvasTile(SQLModel, table=True):
+    __tablename__ = "canvas_tiles"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    step_id: int = Field(foreign_key="canvas_history_steps.id", index=True)
+    tx: int  # Tile column
+    ty: int  # Tile row
+    before: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # zlib-compressed RGBA
+    after: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+# The trigram indexes and search.py's word_similarity need pg_trgm, so
+# create_all installs it alongside the tables
+event.listen(SQLModel.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from metrics import PASSWORD_HASH_LATENCY, record_timing
+
+# Argon2 is preferred; bcrypt stays verifiable and is flagged for rehash on login
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+# passlib and its backends take tens of milliseconds to import, so the
+# context is built on first use rather than at boot
+_context = None
+
+def get_context():
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+
+        _context = CryptContext(
+            schemes=["argon2", "bcrypt"],
+            deprecated="auto",
+            argon2__time_cost=ARGON2_TIME_COST,
+            argon2__memory_cost=ARGON2_MEMORY_COST,
+            argon2__parallelism=ARGON2_PARALLELISM,
+        )
+    return _context
+
+# Hashing runs in a small dedicated pool (argon2 and bcrypt release the GIL),
+# with a cap on queued work so a login burst fails fast instead of piling up
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pwhash")
+_slots: Optional[asyncio.Semaphore] = None
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(HASH_QUEUE_LIMIT)
+    return _slots
+
+async def _run(operation: str, func, *args):
+    slots = _get_slots()
+    if slots.locked():
+        raise HashingBusy("Password hashing queue is full")
+    async with slots:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(_executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            PASSWORD_HASH_LATENCY.observe(elapsed, op=operation)
+            record_timing(f"password_{operation}", elapsed)
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", get_context().hash, password)
+
+# Returns (valid, new_hash); new_hash is set when the stored hash uses a
+# deprecated scheme or outdated cost and should be replaced
+async def verify_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return await _run("verify", get_context().verify_and_update, password, hashed)
+
+def shutdown():
+    _executor.shutdown(wait=False)
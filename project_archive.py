@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from assets import ASSET_TYPES
+from auth import require_user
+from authz import authorize_project, memberships_for, organizations_allowing
+from database import AsyncSessionDep, async_session_maker
+from models import Asset, Project, ThumbnailJob
+from storage import ASSET_MAX_BYTES, BlobStore, BlobTooLarge, DigestMismatch, blob_store, is_digest
+from thumbnails import can_render, thumbnail_worker, thumbnails_ready
+from user_cache import UserSnapshot
+from vector_ops import load_document
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Archive layout: manifest.json (project metadata), assets.ndjson (one asset
+# row per line) and blobs/<sha256> for every distinct blob
+ARCHIVE_FORMAT = "doodledog-project"
+ARCHIVE_VERSION = 1
+IMPORT_MAX_BYTES = int(os.getenv("PROJECT_IMPORT_MAX_BYTES", str(1024 * 1024 * 1024)))
+IMPORT_MAX_UNCOMPRESSED = int(os.getenv("PROJECT_IMPORT_MAX_UNCOMPRESSED", str(4 * 1024 * 1024 * 1024)))
+IMPORT_BATCH_SIZE = int(os.getenv("PROJECT_IMPORT_BATCH_SIZE", "500"))
+CHUNK_SIZE = 1024 * 1024
+
+# Asset types that carry their data in Asset.content rather than a blob
+INLINE_ASSET_TYPES = {"text", "bitmap", "vector"}
+
+# Already-compressed blobs are stored as-is rather than deflated again
+STORED_MIME_TYPES = {"image/png", "image/jpeg", "image/webp"}
+
+class ArchiveProject(BaseModel):
+    name: str
+    type: str
+    created_at: datetime
+    modified_at: datetime
+
+class ArchiveManifest(BaseModel):
+    format: str
+    version: int
+    project: ArchiveProject
+    asset_count: int
+
+class ArchiveAsset(BaseModel):
+    type: str
+    content: Optional[str] = None
+    content_hash: Optional[str] = None
+    mime_type: Optional[str] = None
+    size: Optional[int] = None
+    created_at: datetime
+    modified_at: datetime
+
+class InvalidArchive(Exception):
+    """Raised when an uploaded archive is malformed or inconsistent."""
+
+# Write-only file object for ZipFile. It has no tell()/seek(), so zipfile
+# streams each entry with a trailing data descriptor and everything written
+# can be handed to the response as soon as it is produced.
+class _ZipSink:
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+# Runs in Starlette's threadpool (sync iterator); memory stays at about one
+# read chunk regardless of blob sizes
+def _zip_stream(manifest: dict, assets: List[dict], blob_types: Dict[str, str], store: BlobStore) -> Iterator[bytes]:
+    sink = _ZipSink()
+    now = datetime.utcnow().timetuple()[:6]
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        archive.writestr("manifest.json", json.dumps(manifest, default=str))
+        with archive.open("assets.ndjson", "w") as entry:
+            for asset in assets:
+                entry.write(json.dumps(asset, default=str).encode() + b"\n")
+        yield sink.drain()
+        for digest, mime_type in blob_types.items():
+            info = zipfile.ZipInfo(f"blobs/{digest}", date_time=now)
+            info.compress_type = zipfile.ZIP_STORED if mime_type in STORED_MIME_TYPES else zipfile.ZIP_DEFLATED
+            info.file_size = os.path.getsize(store.path(digest))
+            with archive.open(info, "w") as entry, store.open(digest) as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    yield sink.drain()
+
+# Asset rows as exported. Vector documents are flattened to their latest
+# version; the op-log and snapshots stay behind.
+async def _export_rows(session: AsyncSession, project_id: int, store: BlobStore):
+    assets = (await session.exec(select(Asset).where(Asset.project_id == project_id).order_by(Asset.id))).all()
+    rows, blob_types = [], {}
+    for asset in assets:
+        content = asset.content
+        if asset.type == "vector" and asset.version > 0:
+            content = (await load_document(session, asset)).content
+        content_hash = asset.content_hash
+        if content_hash and not store.exists(content_hash):
+            logger.warning("Asset %s references missing blob %s; exporting without it", asset.id, content_hash)
+            content_hash = None
+        if content_hash:
+            blob_types.setdefault(content_hash, asset.mime_type or "")
+        rows.append(ArchiveAsset(
+            type=asset.type,
+            content=content,
+            content_hash=content_hash,
+            mime_type=asset.mime_type,
+            size=asset.size,
+            created_at=asset.created_at,
+            modified_at=asset.modified_at,
+        ).model_dump())
+    return rows, blob_types
+
+router = APIRouter()
+
+@router.get("/api/projects/{project_id}/export")
+async def export_project(project_id: int, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    project = await authorize_project(session, user.id, project_id, "view")
+    if project is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
+    assets, blob_types = await _export_rows(session, project_id, blob_store)
+    manifest = ArchiveManifest(
+        format=ARCHIVE_FORMAT,
+        version=ARCHIVE_VERSION,
+        project=ArchiveProject(name=project.name, type=project.type, created_at=project.created_at, modified_at=project.modified_at),
+        asset_count=len(assets),
+    ).model_dump()
+    filename = f"project-{project_id}.zip"
+    return StreamingResponse(
+        _zip_stream(manifest, assets, blob_types, blob_store),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
+# Copy the request body to a temp file, writing off the event loop in ~1 MiB
+# batches. Zip's central directory sits at the end, so the archive has to be
+# on disk before it can be read.
+async def _spool_body(request: Request, max_bytes: int = IMPORT_MAX_BYTES):
+    spool = tempfile.NamedTemporaryFile(dir=blob_store.tmp_dir, suffix=".zip", delete=False)
+    size, pending, pending_bytes = 0, [], 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Archive exceeds {max_bytes} bytes")
+            pending.append(chunk)
+            pending_bytes += len(chunk)
+            if pending_bytes >= CHUNK_SIZE:
+                chunks, pending, pending_bytes = pending, [], 0
+                await anyio.to_thread.run_sync(spool.writelines, chunks)
+        if pending:
+            await anyio.to_thread.run_sync(spool.writelines, pending)
+        spool.close()
+        return spool.name
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+
+class _OpenArchive:
+    def __init__(self, path: str, archive: zipfile.ZipFile, manifest: ArchiveManifest, blob_names: List[str]):
+        self.path = path
+        self.archive = archive
+        self.manifest = manifest
+        self.blob_names = blob_names
+
+    def close(self) -> None:
+        self.archive.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+# Check the archive's structure and manifest before any work starts, so bad
+# uploads get a plain 400 instead of an error event mid-stream
+def _open_archive(path: str) -> _OpenArchive:
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        raise InvalidArchive("Not a zip archive") from e
+    try:
+        names = set(archive.namelist())
+        if "manifest.json" not in names or "assets.ndjson" not in names:
+            raise InvalidArchive("Archive is missing manifest.json or assets.ndjson")
+        if sum(info.file_size for info in archive.infolist()) > IMPORT_MAX_UNCOMPRESSED:
+            raise InvalidArchive("Archive expands beyond the import limit")
+        manifest = ArchiveManifest.model_validate_json(archive.read("manifest.json"))
+        if manifest.format != ARCHIVE_FORMAT or manifest.version != ARCHIVE_VERSION:
+            raise InvalidArchive(f"Unsupported archive format {manifest.format!r} v{manifest.version}")
+        blob_names = sorted(name for name in names if name.startswith("blobs/"))
+        if any(not is_digest(name[len("blobs/"):]) for name in blob_names):
+            raise InvalidArchive("Blob entries must be named blobs/<sha256>")
+        return _OpenArchive(path, archive, manifest, blob_names)
+    except (ValidationError, ValueError, zipfile.BadZipFile) as e:
+        archive.close()
+        raise InvalidArchive(f"Invalid manifest: {e}") from e
+    except BaseException:
+        archive.close()
+        raise
+
+# Returns True when the blob was already stored. The entry is hashed either
+# way, so an archive can't claim a stored blob without holding its bytes.
+def _import_blob(archive: zipfile.ZipFile, name: str, store: BlobStore) -> bool:
+    writer = store.writer(name[len("blobs/"):], max_bytes=ASSET_MAX_BYTES)
+    try:
+        with archive.open(name) as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                writer.write(chunk)
+        writer.commit()
+    finally:
+        writer.abort()
+    return writer.deduplicated
+
+def _read_assets(archive: zipfile.ZipFile) -> Iterator[ArchiveAsset]:
+    with archive.open("assets.ndjson") as lines:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                asset = ArchiveAsset.model_validate_json(line)
+            except ValidationError as e:
+                raise InvalidArchive(f"assets.ndjson line {number}: {e.errors()[0]['msg']}") from e
+            # Blobs are served with their mime_type, so only accept the types an
+            # upload could have produced and derive Asset.type from it
+            if asset.content_hash or asset.mime_type:
+                if asset.mime_type not in ASSET_TYPES:
+                    raise InvalidArchive(f"assets.ndjson line {number}: unsupported mime_type {asset.mime_type!r}")
+                if not is_digest(asset.content_hash or ""):
+                    raise InvalidArchive(f"assets.ndjson line {number}: content_hash must be a sha256 digest")
+                asset.type = ASSET_TYPES[asset.mime_type]
+            elif asset.type not in INLINE_ASSET_TYPES:
+                raise InvalidArchive(f"assets.ndjson line {number}: unsupported asset type {asset.type!r}")
+            yield asset
+
+def _event(**fields) -> bytes:
+    return json.dumps(fields).encode() + b"\n"
+
+# Blobs first (content-addressed, so a failed import leaves at most unused
+# blobs behind), then every row in one transaction: the project, assets in
+# multi-row INSERT batches and their thumbnail jobs.
+async def _run_import(opened: _OpenArchive, user_id: int, organization_id: Optional[int], name: Optional[str]) -> AsyncIterator[bytes]:
+    try:
+        blob_total = len(opened.blob_names)
+        stored = deduplicated = 0
+        step = max(1, blob_total // 20)
+        yield _event(stage="blobs", done=0, total=blob_total)
+        for done, blob_name in enumerate(opened.blob_names, 1):
+            if await anyio.to_thread.run_sync(_import_blob, opened.archive, blob_name, blob_store):
+                deduplicated += 1
+            else:
+                stored += 1
+            if done % step == 0 or done == blob_total:
+                yield _event(stage="blobs", done=done, total=blob_total)
+
+        asset_total = opened.manifest.asset_count
+        available = {blob_name[len("blobs/"):] for blob_name in opened.blob_names}
+        project_meta = opened.manifest.project
+        now = datetime.utcnow()
+        async with async_session_maker() as session:
+            project_id = (await session.exec(insert(Project).values(
+                name=name or project_meta.name,
+                type=project_meta.type,
+                owner_id=user_id,
+                organization_id=organization_id,
+                created_at=now,
+                modified_at=now,
+            ).returning(Project.id))).one()[0]
+            yield _event(stage="assets", done=0, total=asset_total)
+            imported = 0
+            batch: List[dict] = []
+            rows = _read_assets(opened.archive)
+            while True:
+                asset = await anyio.to_thread.run_sync(next, rows, None)
+                if asset is not None:
+                    if asset.content_hash and asset.content_hash not in available:
+                        raise InvalidArchive(f"Asset references blob {asset.content_hash} that is not in the archive")
+                    batch.append({
+                        **asset.model_dump(),
+                        "file_path": blob_store.relative_path(asset.content_hash) if asset.content_hash else None,
+                        "project_id": project_id,
+                        "version": 0,
+                    })
+                if batch and (asset is None or len(batch) >= IMPORT_BATCH_SIZE):
+                    inserted = (await session.exec(
+                        insert(Asset).values(batch).returning(Asset.id, Asset.type, Asset.content_hash)
+                    )).all()
+                    jobs = [
+                        {"asset_id": asset_id, "content_hash": content_hash, "status": "done" if thumbnails_ready(content_hash) else "pending", "created_at": now, "updated_at": now}
+                        for asset_id, asset_type, content_hash in inserted
+                        if content_hash and can_render(asset_type)
+                    ]
+                    if jobs:
+                        await session.exec(insert(ThumbnailJob).values(jobs))
+                    imported += len(batch)
+                    batch = []
+                    yield _event(stage="assets", done=imported, total=asset_total)
+                if asset is None:
+                    break
+            await session.commit()
+        thumbnail_worker.wake()
+        yield _event(stage="done", project_id=project_id, assets=imported, blobs_stored=stored, blobs_deduplicated=deduplicated)
+    except (InvalidArchive, BlobTooLarge, DigestMismatch, zipfile.BadZipFile) as e:
+        yield _event(stage="error", detail=str(e))
+    except Exception:
+        logger.exception("Project import failed")
+        yield _event(stage="error", detail="Import failed")
+    finally:
+        await anyio.to_thread.run_sync(opened.close)
+
+# Upload the archive as the raw request body (Content-Type: application/zip).
+# The response is NDJSON progress events ending in {"stage": "done", ...} or
+# {"stage": "error", ...}; nothing is committed unless "done" is reached.
+@router.post("/api/projects/import")
+async def import_project(request: Request, session: AsyncSessionDep, organization_id: Optional[int] = None, name: Optional[str] = None, user: UserSnapshot = Depends(require_user)):
+    if organization_id is not None:
+        memberships = await memberships_for(session, user.id)
+        if organization_id not in organizations_allowing(memberships, "edit"):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot create projects in this organization")
+    path = await _spool_body(request)
+    try:
+        opened = await anyio.to_thread.run_sync(_open_archive, path)
+    except InvalidArchive as e:
+        os.unlink(path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return StreamingResponse(
+        _run_import(opened, user.id, organization_id, name),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-store"},
+    )
@@ -0,0 +1,108 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
+from sqlalchemy import and_, case, func, or_, union_all
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from authz import memberships_for, organizations_allowing
+from models import Asset, Project
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+class ProjectSummary(BaseModel):
+    id: int
+    name: str
+    type: str
+    organization_id: Optional[int] = None
+    modified_at: datetime
+    asset_count: int = 0
+    preview_hash: Optional[str] = None
+
+class ProjectPage(BaseModel):
+    items: List[ProjectSummary]
+    next_cursor: Optional[str] = None
+
+# Cursors encode the (modified_at, id) of the last row on the page
+def encode_cursor(modified_at: datetime, project_id: int) -> str:
+    raw = f"{modified_at.isoformat()}|{project_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        modified_at, project_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(modified_at), int(project_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def _page_query(condition, cursor: Optional[Tuple[datetime, int]], limit: int):
+    query = select(
+        Project.id, Project.name, Project.type, Project.organization_id, Project.modified_at
+    ).where(condition)
+    if cursor is not None:
+        modified_at, project_id = cursor
+        query = query.where(or_(
+            Project.modified_at < modified_at,
+            and_(Project.modified_at == modified_at, Project.id < project_id),
+        ))
+    return query.order_by(Project.modified_at.desc(), Project.id.desc()).limit(limit)
+
+# List projects the user owns or can see through an organization, newest first.
+# Each branch of the union walks its own (owner_id|organization_id, modified_at)
+# index and stops after one page, so cost doesn't grow with the user's history.
+# Organization ids come from the cached membership map; the shared branch
+# excludes owned rows so the branches can be concatenated without a dedup.
+async def list_projects(session: AsyncSession, user_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> ProjectPage:
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    position = decode_cursor(cursor) if cursor else None
+
+    organization_ids = organizations_allowing(await memberships_for(session, user_id))
+    owned = _page_query(Project.owner_id == user_id, position, limit + 1).subquery()
+    branches = [select(owned)]
+    if organization_ids:
+        shared_condition = and_(Project.organization_id.in_(organization_ids), Project.owner_id != user_id)
+        branches.append(select(_page_query(shared_condition, position, limit + 1).subquery()))
+    combined = union_all(*branches).subquery()
+    rows = (await session.exec(
+        select(combined.c.id, combined.c.name, combined.c.type, combined.c.organization_id, combined.c.modified_at)
+        .order_by(combined.c.modified_at.desc(), combined.c.id.desc()).limit(limit + 1)
+    )).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    stats = await asset_stats(session, [row.id for row in rows])
+    items = [
+        ProjectSummary(
+            id=row.id,
+            name=row.name,
+            type=row.type,
+            organization_id=row.organization_id,
+            modified_at=row.modified_at,
+            asset_count=stats.get(row.id, (0, None))[0],
+            preview_hash=stats.get(row.id, (0, None))[1],
+        )
+        for row in rows
+    ]
+    next_cursor = encode_cursor(rows[-1].modified_at, rows[-1].id) if has_more else None
+    return ProjectPage(items=items, next_cursor=next_cursor)
+
+# Asset count and preview blob per project for a page of projects: one
+# grouped query finds the count and newest image asset, a second fetches hashes
+async def asset_stats(session: AsyncSession, project_ids: List[int]) -> dict:
+    if not project_ids:
+        return {}
+    has_preview = and_(Asset.content_hash.is_not(None), Asset.type.in_(("bitmap", "vector")))
+    rows = (await session.exec(
+        select(Asset.project_id, func.count(Asset.id), func.max(case((has_preview, Asset.id))))
+        .where(Asset.project_id.in_(project_ids))
+        .group_by(Asset.project_id)
+    )).all()
+    preview_ids = [preview_id for _, _, preview_id in rows if preview_id is not None]
+    hashes = {}
+    if preview_ids:
+        hashes = dict((await session.exec(
+            select(Asset.id, Asset.content_hash).where(Asset.id.in_(preview_ids))
+        )).all())
+    return {project_id: (count, hashes.get(preview_id)) for project_id, count, preview_id in rows}
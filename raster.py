@@ -0,0 +1,309 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Annotated, List, Literal, Optional, Sequence, Tuple, Union
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field, conint
+from sqlmodel import select
+from database import AsyncSessionDep
+from models import Asset
+from auth import require_user
+from authz import authorize_project
+from storage import ASSET_STORAGE_DIR, BlobStore, blob_store
+from thumbnails import enqueue_thumbnail
+from user_cache import UserSnapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Decoded pixels for images above this size are cached as .npy files and
+# memory-mapped instead of being held in process memory
+RASTER_CACHE_DIR = os.getenv("RASTER_CACHE_DIR", "storage/raster_cache")
+RASTER_MMAP_THRESHOLD = int(os.getenv("RASTER_MMAP_THRESHOLD", str(4096 * 4096)))
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", "2"))
+RASTER_MAX_PIXELS = 16384 * 16384
+
+FORMATS = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+class InvalidStep(ValueError):
+    """Raised when a pipeline step doesn't fit the image it is applied to."""
+
+# All functions work on H x W x 4 uint8 RGBA arrays
+
+def decode(data_or_path) -> np.ndarray:
+    from PIL import Image
+
+    with Image.open(data_or_path) as image:
+        return np.asarray(image.convert("RGBA"))
+
+def load_blob(digest: str, store: BlobStore = blob_store) -> np.ndarray:
+    from PIL import Image
+
+    path = store.path(digest)
+    with Image.open(path) as image:
+        pixels = image.width * image.height
+    if pixels < RASTER_MMAP_THRESHOLD:
+        return decode(path)
+    cached = os.path.join(RASTER_CACHE_DIR, digest[:2], f"{digest}.npy")
+    if not os.path.isfile(cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cached), suffix=".npy")
+        with os.fdopen(fd, "wb") as tmp:
+            np.save(tmp, decode(path))
+        os.replace(tmp_path, cached)
+    return np.load(cached, mmap_mode="r")
+
+def encode(image: np.ndarray, fmt: str = "png") -> bytes:
+    from PIL import Image
+
+    pil_image = Image.fromarray(np.ascontiguousarray(image), "RGBA")
+    if fmt == "jpeg":
+        pil_image = pil_image.convert("RGB")
+    buffer = io.BytesIO()
+    pil_image.save(buffer, fmt.upper(), optimize=fmt == "png")
+    return buffer.getvalue()
+
+def _row_runs(mask: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # Start/end (exclusive) columns of every True run, per row
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows_start, cols_start = np.nonzero(edges == 1)
+    rows_end, cols_end = np.nonzero(edges == -1)
+    split_start = np.searchsorted(rows_start, np.arange(1, height))
+    split_end = np.searchsorted(rows_end, np.arange(1, height))
+    return list(zip(np.split(cols_start, split_start), np.split(cols_end, split_end)))
+
+# Scanline flood fill. The fillable mask is computed for the whole image in
+# one vectorized pass; the fill itself then walks whole runs, not pixels.
+def flood_fill(image: np.ndarray, x: int, y: int, color: Sequence[int], tolerance: int = 0) -> np.ndarray:
+    height, width = image.shape[:2]
+    if not (0 <= x < width and 0 <= y < height):
+        raise InvalidStep("Seed point is outside the image")
+    seed = image[y, x].astype(np.int16)
+    mask = np.all(np.abs(image.astype(np.int16) - seed) <= tolerance, axis=-1)
+    runs = _row_runs(mask)
+    filled = np.zeros((height, width), dtype=bool)
+    stack = [(x, y)]
+    while stack:
+        px, py = stack.pop()
+        starts, ends = runs[py]
+        index = np.searchsorted(starts, px, side="right") - 1
+        if index < 0 or px >= ends[index] or filled[py, px]:
+            continue
+        start, end = starts[index], ends[index]
+        filled[py, start:end] = True
+        for ny in (py - 1, py + 1):
+            if not 0 <= ny < height:
+                continue
+            n_starts, n_ends = runs[ny]
+            lo = np.searchsorted(n_ends, start, side="right")
+            hi = np.searchsorted(n_starts, end, side="left")
+            for run_start, run_end in zip(n_starts[lo:hi], n_ends[lo:hi]):
+                seed_x = max(run_start, start)
+                if not filled[ny, seed_x]:
+                    stack.append((seed_x, ny))
+    result = np.array(image, copy=True)
+    result[filled] = np.asarray(color, dtype=np.uint8)
+    return result
+
+def crop(image: np.ndarray, left: int, top: int, width: int, height: int) -> np.ndarray:
+    if width <= 0 or height <= 0 or left < 0 or top < 0 or left + width > image.shape[1] or top + height > image.shape[0]:
+        raise InvalidStep("Crop box is outside the image")
+    return np.array(image[top:top + height, left:left + width], copy=True)
+
+def resize(image: np.ndarray, width: int, height: int, method: str = "bilinear") -> np.ndarray:
+    if width <= 0 or height <= 0 or width * height > RASTER_MAX_PIXELS:
+        raise InvalidStep("Invalid target size")
+    src_h, src_w = image.shape[:2]
+    if method == "nearest":
+        rows = (np.arange(height) * src_h // height)
+        cols = (np.arange(width) * src_w // width)
+        return image[rows[:, None], cols]
+    # Bilinear on premultiplied alpha so transparent pixels don't bleed color
+    ys = np.clip((np.arange(height) + 0.5) * src_h / height - 0.5, 0, src_h - 1)
+    xs = np.clip((np.arange(width) + 0.5) * src_w / width - 0.5, 0, src_w - 1)
+    y0 = np.floor(ys).astype(np.intp)
+    x0 = np.floor(xs).astype(np.intp)
+    y1 = np.minimum(y0 + 1, src_h - 1)
+    x1 = np.minimum(x0 + 1, src_w - 1)
+    wy = (ys - y0).astype(np.float32)[:, None, None]
+    wx = (xs - x0).astype(np.float32)[None, :, None]
+    src = image.astype(np.float32)
+    src[..., :3] *= src[..., 3:4] / 255.0
+    # Separable: interpolate columns first, then rows of the narrower result
+    columns = src[:, x0] * (1 - wx) + src[:, x1] * wx
+    out = columns[y0] * (1 - wy) + columns[y1] * wy
+    alpha = out[..., 3:4]
+    out[..., :3] = np.where(alpha > 0, out[..., :3] * 255.0 / np.maximum(alpha, 1e-6), 0)
+    return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+
+# Porter-Duff "over" of each layer onto the base, at (x, y) with opacity
+def composite(base: np.ndarray, layers: Sequence[Tuple[np.ndarray, int, int, float]]) -> np.ndarray:
+    out = base.astype(np.float32) / 255.0
+    height, width = out.shape[:2]
+    for layer, x, y, opacity in layers:
+        top, left = max(y, 0), max(x, 0)
+        bottom, right = min(y + layer.shape[0], height), min(x + layer.shape[1], width)
+        if top >= bottom or left >= right:
+            continue
+        src = layer[top - y:bottom - y, left - x:right - x].astype(np.float32) / 255.0
+        dst = out[top:bottom, left:right]
+        src_a = src[..., 3:4] * opacity
+        dst_a = dst[..., 3:4]
+        out_a = src_a + dst_a * (1 - src_a)
+        rgb = (src[..., :3] * src_a + dst[..., :3] * dst_a * (1 - src_a)) / np.maximum(out_a, 1e-6)
+        dst[..., :3] = np.where(out_a > 0, rgb, 0)
+        dst[..., 3:4] = out_a
+    return np.clip(np.rint(out * 255.0), 0, 255).astype(np.uint8)
+
+# Batch pipeline steps
+class FloodFillStep(BaseModel):
+    op: Literal["flood_fill"]
+    x: int
+    y: int
+    color: Tuple[conint(ge=0, le=255), conint(ge=0, le=255), conint(ge=0, le=255), conint(ge=0, le=255)]
+    tolerance: int = 0
+
+class CropStep(BaseModel):
+    op: Literal["crop"]
+    left: int
+    top: int
+    width: int
+    height: int
+
+class ResizeStep(BaseModel):
+    op: Literal["resize"]
+    width: Optional[int] = None
+    height: Optional[int] = None
+    scale: Optional[float] = None
+    method: Literal["bilinear", "nearest"] = "bilinear"
+
+Step = Annotated[Union[FloodFillStep, CropStep, ResizeStep], Field(discriminator="op")]
+
+class BatchRequest(BaseModel):
+    steps: List[Step]
+    format: Literal["png", "webp", "jpeg"] = "png"
+    asset_ids: Optional[List[int]] = None  # defaults to every bitmap asset in the project
+
+# One per requested asset id, in request order
+class BatchResult(BaseModel):
+    source_asset_id: int
+    asset_id: Optional[int] = None
+    content_hash: Optional[str] = None
+    error: Optional[str] = None
+
+def apply_steps(image: np.ndarray, steps: Sequence[dict]) -> np.ndarray:
+    for step in steps:
+        if step["op"] == "flood_fill":
+            image = flood_fill(image, step["x"], step["y"], step["color"], step["tolerance"])
+        elif step["op"] == "crop":
+            image = crop(image, step["left"], step["top"], step["width"], step["height"])
+        elif step["op"] == "resize":
+            height, width = image.shape[:2]
+            if step.get("scale"):
+                target = (round(width * step["scale"]), round(height * step["scale"]))
+            else:
+                target = (step.get("width") or width, step.get("height") or height)
+            image = resize(image, target[0], target[1], step["method"])
+    return image
+
+# Runs in a worker process: load, transform, encode and store one blob
+def process_blob(digest: str, steps: Sequence[dict], fmt: str, store_root: str) -> Tuple[str, int]:
+    store = BlobStore(store_root)
+    image = apply_steps(load_blob(digest, store), steps)
+    data = encode(image, fmt)
+    writer = store.writer()
+    writer.write(data)
+    return writer.commit(), len(data)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=RASTER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+# Message for a failed source. Exceptions come back from the worker process,
+# and only the pipeline's own errors are meant for clients.
+def _failure_message(asset_id: int, error: BaseException) -> str:
+    from PIL import Image, UnidentifiedImageError
+
+    if isinstance(error, InvalidStep):
+        return str(error)
+    if isinstance(error, FileNotFoundError):
+        return "Source image is missing"
+    if isinstance(error, UnidentifiedImageError):
+        return "Source is not a readable image"
+    if isinstance(error, Image.DecompressionBombError):
+        return "Source image is too large"
+    logger.error("Raster batch failed for asset %s", asset_id, exc_info=error)
+    return "Processing failed"
+
+def shutdown():
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+router = APIRouter()
+
+# Apply the same pipeline to many bitmap assets (e.g. re-export at 2x). Each
+# result is stored as a new asset; the sources are left untouched. Results
+# follow `asset_ids`; ids that aren't bitmaps in this project get an error.
+@router.post("/api/projects/{project_id}/raster/batch", response_model=List[BatchResult])
+async def raster_batch(project_id: int, batch: BatchRequest, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    project = await authorize_project(session, user.id, project_id, "edit")
+    if project is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
+    query = select(Asset).where(Asset.project_id == project_id, Asset.type == "bitmap", Asset.content_hash.is_not(None))
+    if batch.asset_ids is not None:
+        query = query.where(Asset.id.in_(batch.asset_ids))
+    sources = (await session.exec(query.order_by(Asset.id))).all()
+    requested = [asset.id for asset in sources] if batch.asset_ids is None else batch.asset_ids
+    steps = [step.model_dump() for step in batch.steps]
+
+    loop = asyncio.get_running_loop()
+    outcomes = await asyncio.gather(
+        *(loop.run_in_executor(get_executor(), process_blob, asset.content_hash, steps, batch.format, ASSET_STORAGE_DIR) for asset in sources),
+        return_exceptions=True,
+    )
+    now = datetime.utcnow()
+    results = {}
+    created = []
+    for asset, outcome in zip(sources, outcomes):
+        if isinstance(outcome, BaseException):
+            results[asset.id] = BatchResult(source_asset_id=asset.id, error=_failure_message(asset.id, outcome))
+            continue
+        digest, size = outcome
+        new_asset = Asset(
+            project_id=project_id,
+            type="bitmap",
+            file_path=blob_store.relative_path(digest),
+            content_hash=digest,
+            mime_type=FORMATS[batch.format],
+            size=size,
+            created_at=now,
+            modified_at=now,
+        )
+        session.add(new_asset)
+        created.append((asset.id, new_asset))
+    if created:
+        project.modified_at = now
+        session.add(project)
+        await session.commit()
+    for source_id, new_asset in created:
+        await enqueue_thumbnail(session, new_asset)
+        results[source_id] = BatchResult(source_asset_id=source_id, asset_id=new_asset.id, content_hash=new_asset.content_hash)
+    return [
+        results.get(asset_id) or BatchResult(source_asset_id=asset_id, error="Not a bitmap asset in this project")
+        for asset_id in requested
+    ]
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import anyio
+from fastapi import HTTPException, Request, status
+from metrics import Counter, Histogram, record_timing
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Limiter settings. "memory" is per worker, "sqlite" is shared by every worker
+# on the host, "network" talks to a counter service (see CounterClientStore).
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "storage/ratelimit.sqlite3")
+
+RATE_LIMIT_LATENCY = Histogram("rate_limit_check_duration_seconds", "Rate limiter check time by store", (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+RATE_LIMIT_REJECTIONS = Counter("rate_limit_rejections_total", "Requests rejected by the rate limiter")
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+@dataclass(frozen=True)
+class RateLimit:
+    limit: int
+    window: float  # seconds
+
+    @classmethod
+    def parse(cls, spec: str) -> "RateLimit":
+        # "5/minute", "100/hour" or "10/30s"
+        count, _, period = spec.partition("/")
+        period = period.strip().lower()
+        if period.endswith("s") and period[:-1].isdigit():
+            return cls(int(count), float(period[:-1]))
+        if period.endswith("s") and period[:-1] in PERIODS:
+            period = period[:-1]
+        return cls(int(count), float(PERIODS[period]))
+
+@dataclass
+class Decision:
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+# Sliding-window counter: the previous fixed window's count is weighted by
+# how much of it still overlaps the sliding window. Two integers per key,
+# constant work per check. Rejected attempts are not counted.
+def evaluate(rule: RateLimit, now: float, window_index: int, current: int, previous: int) -> Decision:
+    elapsed = now - window_index * rule.window
+    weight = 1.0 - elapsed / rule.window
+    estimate = previous * weight + current
+    if estimate + 1 > rule.limit:
+        # Earliest time the weighted estimate drops enough to admit one more
+        if current + 1 > rule.limit:
+            retry_after = rule.window - elapsed
+        else:
+            needed = (rule.limit - 1 - current) / previous if previous else 1.0
+            retry_after = max(0.0, (1.0 - needed) * rule.window - elapsed)
+        return Decision(False, 0, retry_after)
+    return Decision(True, int(rule.limit - estimate - 1), 0.0)
+
+# Per-worker store. Keys are kept in one recency-ordered dict per window
+# length, so idle keys (untouched for two windows) are swept from the front
+# in amortised O(1).
+class MemoryStore:
+    name = "memory"
+
+    def __init__(self):
+        self._keys: Dict[float, "OrderedDict[str, List[int]]"] = {}
+
+    async def hit(self, key: str, rule: RateLimit, now: float) -> Decision:
+        window_index = int(now // rule.window)
+        entries = self._keys.setdefault(rule.window, OrderedDict())
+        self._sweep(entries, window_index)
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = [window_index, 0, 0]
+        else:
+            entries.move_to_end(key)
+            _roll(entry, window_index)
+        decision = evaluate(rule, now, window_index, entry[1], entry[2])
+        if decision.allowed:
+            entry[1] += 1
+        return decision
+
+    def _sweep(self, entries: "OrderedDict[str, List[int]]", window_index: int) -> None:
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[0] >= window_index - 1:
+                break
+            del entries[key]
+
+    def size(self) -> int:
+        return sum(len(entries) for entries in self._keys.values())
+
+def _roll(entry: List[int], window_index: int) -> None:
+    # entry = [window_index, current, previous]
+    if entry[0] == window_index:
+        return
+    entry[2] = entry[1] if entry[0] == window_index - 1 else 0
+    entry[1] = 0
+    entry[0] = window_index
+
+# Host-wide store in a SQLite file (WAL mode), so every uvicorn worker on the
+# machine shares the same counters. Each check is one short IMMEDIATE
+# transaction run off the event loop; expired rows are purged periodically.
+class SQLiteStore:
+    name = "sqlite"
+    purge_interval = 60.0
+
+    def __init__(self, path: str = RATE_LIMIT_SQLITE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, window INTEGER NOT NULL, current INTEGER NOT NULL, "
+            "previous INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _hit_sync(self, key: str, rule: RateLimit, now: float) -> Decision:
+        conn = self._connection()
+        window_index = int(now // rule.window)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT window, current, previous FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            entry = list(row) if row else [window_index, 0, 0]
+            _roll(entry, window_index)
+            decision = evaluate(rule, now, window_index, entry[1], entry[2])
+            if decision.allowed:
+                conn.execute(
+                    "INSERT INTO rate_limits (key, window, current, previous, expires_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET window = excluded.window, current = excluded.current, "
+                    "previous = excluded.previous, expires_at = excluded.expires_at",
+                    (key, window_index, entry[1] + 1, entry[2], (window_index + 2) * rule.window),
+                )
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                conn.execute("DELETE FROM rate_limits WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    async def hit(self, key: str, rule: RateLimit, now: float) -> Decision:
+        return await anyio.to_thread.run_sync(self._hit_sync, key, rule, now)
+
+# Store backed by a network counter service. The client only needs
+# incr/decr/get/expire with Redis semantics, so a redis.asyncio client can be
+# passed in directly. Admission is decided after the atomic increment and
+# undone on rejection, so concurrent workers can never over-admit.
+class CounterClientStore:
+    name = "network"
+
+    def __init__(self, client):
+        self.client = client
+
+    async def hit(self, key: str, rule: RateLimit, now: float) -> Decision:
+        window_index = int(now // rule.window)
+        current_key = f"{key}:{window_index}"
+        previous = int(await self.client.get(f"{key}:{window_index - 1}") or 0)
+        current = int(await self.client.incr(current_key))
+        if current == 1:
+            await self.client.expire(current_key, int(math.ceil(rule.window * 2)))
+        decision = evaluate(rule, now, window_index, current - 1, previous)
+        if not decision.allowed:
+            await self.client.decr(current_key)
+        return decision
+
+# In-process stand-in for a network counter service, with the same
+# incr/decr/get/expire calls and key expiry
+class LocalCounterClient:
+    def __init__(self):
+        self._values: Dict[str, Tuple[int, float]] = {}
+        self._lock = asyncio.Lock()
+
+    def _live(self, key: str) -> int:
+        value = self._values.get(key)
+        if value is None:
+            return 0
+        if value[1] <= time.monotonic():
+            del self._values[key]
+            return 0
+        return value[0]
+
+    async def get(self, key: str) -> Optional[int]:
+        value = self._live(key)
+        return value or None
+
+    async def incr(self, key: str) -> int:
+        async with self._lock:
+            value = self._live(key) + 1
+            expires_at = self._values.get(key, (0, math.inf))[1]
+            self._values[key] = (value, expires_at)
+            return value
+
+    async def decr(self, key: str) -> int:
+        async with self._lock:
+            value = self._live(key) - 1
+            expires_at = self._values.get(key, (0, math.inf))[1]
+            self._values[key] = (value, expires_at)
+            return value
+
+    async def expire(self, key: str, seconds: int) -> None:
+        if key in self._values:
+            self._values[key] = (self._values[key][0], time.monotonic() + seconds)
+
+class RateLimiter:
+    def __init__(self, store, enabled: bool = RATE_LIMIT_ENABLED):
+        self.store = store
+        self.enabled = enabled
+
+    async def check(self, scope: str, key: str, rule: RateLimit) -> Decision:
+        start = time.perf_counter()
+        decision = await self.store.hit(f"{scope}:{key}", rule, time.time())
+        elapsed = time.perf_counter() - start
+        RATE_LIMIT_LATENCY.observe(elapsed, store=self.store.name)
+        record_timing("ratelimit", elapsed)
+        if not decision.allowed:
+            RATE_LIMIT_REJECTIONS.inc(scope=scope)
+        return decision
+
+    # FastAPI dependency. Keys by client IP, or by the submitted username for
+    # "username" (form field), so an account can't be brute-forced from many
+    # addresses. Several dependencies can guard the same route.
+    def limit(self, spec: str, key: str = "ip", scope: Optional[str] = None):
+        rule = RateLimit.parse(spec)
+
+        async def dependency(request: Request) -> None:
+            if not self.enabled:
+                return
+            if key == "username":
+                form = await request.form()
+                value = str(form.get("username") or "").strip().lower()
+                if not value:
+                    return
+            else:
+                value = request.client.host if request.client else "unknown"
+            name = scope or f"{request.scope['route'].path}:{key}"
+            decision = await self.check(name, value, rule)
+            if not decision.allowed:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests, please try again later",
+                    headers={"Retry-After": str(max(1, math.ceil(decision.retry_after)))},
+                )
+
+        return dependency
+
+def _make_store():
+    if RATE_LIMIT_STORE == "sqlite":
+        return SQLiteStore(RATE_LIMIT_SQLITE_PATH)
+    if RATE_LIMIT_STORE == "network":
+        logger.warning("RATE_LIMIT_STORE=network without a counter service; using the local stand-in")
+        return CounterClientStore(LocalCounterClient())
+    return MemoryStore()
+
+limiter = RateLimiter(_make_store())
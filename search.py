@@ -0,0 +1,453 @@
+import asyncio
+import base64
+import math
+import os
+import re
+from bisect import bisect_left
+from decimal import Decimal
+from itertools import chain
+from typing import Callable, Dict, List, Literal, Optional, Set, Tuple
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import Numeric, and_, cast, event, func, literal, literal_column, or_, union_all
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from auth import require_user
+from authz import can, memberships_for, organizations_allowing
+from database import ASYNC_DATABASE_URL, AsyncSessionDep
+from models import Asset, Project
+from user_cache import UserSnapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "postgres" queries the pg_trgm/tsvector indexes declared on the models
+# (created by create_all, or migration 7f4a2b9c3e18). "memory" keeps an inverted index in each worker, for SQLite
+# test runs; it only sees commits made by its own worker.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND") or ("postgres" if ASYNC_DATABASE_URL.startswith("postgresql") else "memory")
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+MAX_QUERY_TERMS = 8
+NAME_WEIGHT = 2.0  # a hit in a project name outranks the same hit in a document
+SNIPPET_CHARS = 160
+
+TOKEN_RE = re.compile(r"\w+")
+
+Kind = Literal["project", "asset"]
+KIND_ORDER = {"project": 0, "asset": 1}
+
+class SearchHit(BaseModel):
+    kind: Kind
+    id: int
+    project_id: int
+    project_name: str
+    snippet: Optional[str] = None
+    score: float
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+# Cursors carry the (score, kind, id) of the last hit; scores are rounded to
+# six places by both backends so they compare exactly
+def encode_cursor(score: float, kind: str, hit_id: int) -> str:
+    raw = f"{score}|{kind}|{hit_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Decimal, str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, kind, hit_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        if kind not in KIND_ORDER:
+            raise ValueError(kind)
+        return Decimal(score), kind, int(hit_id)
+    except (ArithmeticError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def _after_cursor(key: Tuple[Decimal, str, int], cursor: Tuple[Decimal, str, int]) -> bool:
+    score, kind, hit_id = key
+    cursor_score, cursor_kind, cursor_id = cursor
+    if score != cursor_score:
+        return score < cursor_score
+    return (KIND_ORDER[kind], hit_id) > (KIND_ORDER[cursor_kind], cursor_id)
+
+# Short excerpt around the first query term found in `text`
+def snippet(text: Optional[str], terms: List[str], width: int = SNIPPET_CHARS) -> Optional[str]:
+    if not text:
+        return None
+    lowered = text.lower()
+    positions = [position for position in (lowered.find(term) for term in terms) if position >= 0]
+    start = max(0, min(positions) - width // 4) if positions else 0
+    excerpt = " ".join(text[start:start + width].split())
+    return ("…" if start > 0 else "") + excerpt + ("…" if start + width < len(text) else "")
+
+# Edit distance, giving up once it exceeds `limit`
+def bounded_distance(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def typo_budget(term: str) -> int:
+    if len(term) < 4:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+DocKey = Tuple[str, int]  # (kind, id)
+
+# In-process inverted index over project names and text assets. Exact terms
+# score highest, then prefixes of longer words (bisect over the sorted
+# vocabulary), then words within a small edit distance (found through a
+# trigram index over the vocabulary). Every query term must match.
+class InvertedIndex:
+    exact_weight = 1.0
+    prefix_weight = 0.7
+    typo_weight = 0.5
+    max_expansions = 64
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[DocKey, int]] = {}
+        self.doc_terms: Dict[DocKey, Dict[str, int]] = {}
+        self.texts: Dict[DocKey, str] = {}
+        self.asset_projects: Dict[int, int] = {}
+        self.projects: Dict[int, Tuple[str, int, Optional[int]]] = {}  # id -> (name, owner_id, organization_id)
+        self.vocabulary: List[str] = []
+        self.trigrams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def set_project(self, project_id: int, name: str, owner_id: int, organization_id: Optional[int]) -> None:
+        self.projects[project_id] = (name, owner_id, organization_id)
+        self._index(("project", project_id), name)
+
+    def remove_project(self, project_id: int) -> None:
+        self.projects.pop(project_id, None)
+        self._unindex(("project", project_id))
+
+    def set_asset(self, asset_id: int, project_id: int, content: Optional[str]) -> None:
+        self.asset_projects[asset_id] = project_id
+        self._index(("asset", asset_id), content or "")
+
+    def remove_asset(self, asset_id: int) -> None:
+        self.asset_projects.pop(asset_id, None)
+        self._unindex(("asset", asset_id))
+
+    def _index(self, key: DocKey, text: str) -> None:
+        self._unindex(key)
+        counts: Dict[str, int] = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        self.doc_terms[key] = counts
+        self.texts[key] = text
+        for token, count in counts.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = {}
+                self.vocabulary.insert(bisect_left(self.vocabulary, token), token)
+                for trigram in _trigrams(token):
+                    self.trigrams.setdefault(trigram, set()).add(token)
+            postings[key] = count
+
+    def _unindex(self, key: DocKey) -> None:
+        self.texts.pop(key, None)
+        for token in self.doc_terms.pop(key, {}):
+            postings = self.postings[token]
+            del postings[key]
+            if not postings:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+                for trigram in _trigrams(token):
+                    tokens = self.trigrams[trigram]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.trigrams[trigram]
+
+    # Vocabulary words matching `term`, with the weight of the best match kind
+    def expand(self, term: str) -> Dict[str, float]:
+        matches: Dict[str, float] = {}
+        if term in self.postings:
+            matches[term] = self.exact_weight
+        position = bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and len(matches) < self.max_expansions:
+            token = self.vocabulary[position]
+            if not token.startswith(term):
+                break
+            matches.setdefault(token, self.prefix_weight)
+            position += 1
+        budget = typo_budget(term)
+        if budget:
+            candidates: Set[str] = set()
+            for trigram in _trigrams(term):
+                candidates.update(self.trigrams.get(trigram, ()))
+            for token in candidates:
+                if token not in matches and bounded_distance(term, token, budget) <= budget:
+                    matches[token] = self.typo_weight
+        return matches
+
+    def project_of(self, key: DocKey) -> Optional[int]:
+        return key[1] if key[0] == "project" else self.asset_projects.get(key[1])
+
+    # (score, kind, id, project_id) for documents matching every term
+    def search(self, terms: List[str], allowed: Callable[[int], bool]) -> List[Tuple[float, str, int, int]]:
+        total = max(1, len(self.doc_terms))
+        scores: Optional[Dict[DocKey, float]] = None
+        for term in terms:
+            term_scores: Dict[DocKey, float] = {}
+            for token, weight in self.expand(term).items():
+                postings = self.postings[token]
+                idf = math.log(1 + total / len(postings))
+                for key, count in postings.items():
+                    score = weight * idf * (1 + math.log(count))
+                    if score > term_scores.get(key, 0.0):
+                        term_scores[key] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: scores[key] + score for key, score in term_scores.items() if key in scores}
+            if not scores:
+                return []
+        hits = []
+        for key, score in (scores or {}).items():
+            project_id = self.project_of(key)
+            if project_id is None or project_id not in self.projects or not allowed(project_id):
+                continue
+            if key[0] == "project":
+                score *= NAME_WEIGHT
+            hits.append((round(score, 6), key[0], key[1], project_id))
+        return hits
+
+# Owns the worker's InvertedIndex. It is built from the database on the first
+# search (not at boot) and then kept current from committed sessions; changes
+# committed while a build is running are replayed onto the new index.
+class SearchIndexManager:
+    def __init__(self):
+        self.index: Optional[InvertedIndex] = None
+        self.stale = False
+        self._building = False
+        self._buffered: List[tuple] = []
+        self._lock = asyncio.Lock()
+
+    async def get(self, session: AsyncSession) -> InvertedIndex:
+        if self.index is not None and not self.stale:
+            return self.index
+        async with self._lock:
+            if self.index is None or self.stale:
+                await self._build(session)
+        return self.index
+
+    async def _build(self, session: AsyncSession) -> None:
+        self._building = True
+        self._buffered = []
+        self.stale = False
+        try:
+            index = InvertedIndex()
+            for row in (await session.exec(select(Project.id, Project.name, Project.owner_id, Project.organization_id))).all():
+                index.set_project(row.id, row.name, row.owner_id, row.organization_id)
+            rows = await session.stream(select(Asset.id, Asset.project_id, Asset.content).where(Asset.type == "text"))
+            async for row in rows:
+                index.set_asset(row.id, row.project_id, row.content)
+            for change in self._buffered:
+                _apply(index, change)
+            self.index = index
+        finally:
+            self._building = False
+            self._buffered = []
+
+    def apply(self, changes: List[tuple]) -> None:
+        if self._building:
+            self._buffered.extend(changes)
+        if self.index is not None:
+            for change in changes:
+                _apply(self.index, change)
+
+    def invalidate(self) -> None:
+        self.stale = True
+
+search_index = SearchIndexManager()
+
+def _apply(index: InvertedIndex, change: tuple) -> None:
+    kind, action, values = change
+    if kind == "project":
+        if action == "delete":
+            index.remove_project(values[0])
+        else:
+            index.set_project(*values)
+    elif action == "delete":
+        index.remove_asset(values[0])
+    else:
+        index.set_asset(*values)
+
+# Keep the memory index current: changes are captured at flush, applied after
+# commit and dropped on rollback. Bulk statements that bypass the unit of work
+# mark the index stale so the next search rebuilds it, unless they are UPDATEs
+# that leave the indexed columns alone (vector saves bump version/modified_at).
+_PENDING_KEY = "search_changes"
+INDEXED_COLUMNS = {"name", "owner_id", "organization_id", "type", "content", "project_id"}
+
+@event.listens_for(Session, "after_flush")
+def _collect_search_changes(session: Session, flush_context) -> None:
+    if SEARCH_BACKEND != "memory":
+        return
+    changes = session.info.setdefault(_PENDING_KEY, [])
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Project):
+            changes.append(("project", "set", (obj.id, obj.name, obj.owner_id, obj.organization_id)))
+        elif isinstance(obj, Asset):
+            if obj.type == "text":
+                changes.append(("asset", "set", (obj.id, obj.project_id, obj.content)))
+            elif obj in session.dirty:
+                changes.append(("asset", "delete", (obj.id,)))
+    for obj in session.deleted:
+        if isinstance(obj, (Project, Asset)):
+            changes.append(("project" if isinstance(obj, Project) else "asset", "delete", (obj.id,)))
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_search_changes(state) -> None:
+    if SEARCH_BACKEND != "memory" or not (state.is_insert or state.is_update or state.is_delete):
+        return
+    mapper = state.bind_mapper
+    if mapper is None or mapper.class_ not in (Project, Asset):
+        return
+    if state.is_update and not INDEXED_COLUMNS & set(state.statement.compile().params):
+        return
+    state.session.info[_PENDING_KEY + "_bulk"] = True
+
+@event.listens_for(Session, "after_commit")
+def _publish_search_changes(session: Session) -> None:
+    changes = session.info.pop(_PENDING_KEY, None)
+    if session.info.pop(_PENDING_KEY + "_bulk", False):
+        search_index.invalidate()
+    if changes:
+        search_index.apply(changes)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_search_changes(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_PENDING_KEY + "_bulk", None)
+
+async def _search_memory(session: AsyncSession, user_id: int, terms: List[str], position, limit: int) -> List[SearchHit]:
+    memberships = await memberships_for(session, user_id)
+    index = await search_index.get(session)
+
+    def allowed(project_id: int) -> bool:
+        _, owner_id, organization_id = index.projects[project_id]
+        return can(user_id, memberships, owner_id, organization_id, "view")
+
+    ranked = sorted(index.search(terms, allowed), key=lambda hit: (-hit[0], KIND_ORDER[hit[1]], hit[2]))
+    if position is not None:
+        ranked = [hit for hit in ranked if _after_cursor((Decimal(str(hit[0])), hit[1], hit[2]), position)]
+    return [
+        SearchHit(
+            kind=kind,
+            id=hit_id,
+            project_id=project_id,
+            project_name=index.projects[project_id][0],
+            snippet=snippet(index.texts.get((kind, hit_id)), terms) if kind == "asset" else None,
+            score=score,
+        )
+        for score, kind, hit_id, project_id in ranked[:limit]
+    ]
+
+# Postgres: the project-name and text-asset branches each use their GIN
+# indexes (tsvector for whole words and prefixes, trigram word_similarity for
+# typos), are restricted to the user's projects, and are merged by rank.
+SIMPLE = literal_column("'simple'")
+
+def _rank(expression):
+    return func.round(cast(expression, Numeric), 6)
+
+async def _search_postgres(session: AsyncSession, user_id: int, terms: List[str], position, limit: int) -> List[SearchHit]:
+    organization_ids = organizations_allowing(await memberships_for(session, user_id))
+    accessible = or_(Project.owner_id == user_id, Project.organization_id.in_(organization_ids))
+    phrase = " ".join(terms)
+    query = func.to_tsquery(SIMPLE, " & ".join(f"{term}:*" for term in terms))
+
+    name_vector = func.to_tsvector(SIMPLE, Project.name)
+    projects = select(
+        literal("project").label("kind"),
+        Project.id.label("id"),
+        Project.id.label("project_id"),
+        Project.name.label("project_name"),
+        _rank((func.ts_rank(name_vector, query) + func.word_similarity(phrase, Project.name)) * NAME_WEIGHT).label("score"),
+    ).where(accessible, or_(name_vector.op("@@")(query), Project.name.op("%>")(phrase)))
+
+    content_vector = func.to_tsvector(SIMPLE, Asset.content)
+    assets = select(
+        literal("asset").label("kind"),
+        Asset.id.label("id"),
+        Asset.project_id.label("project_id"),
+        Project.name.label("project_name"),
+        _rank(func.ts_rank(content_vector, query) + func.word_similarity(phrase, Asset.content)).label("score"),
+    ).join(Project, Project.id == Asset.project_id).where(
+        Asset.type == "text", accessible, or_(content_vector.op("@@")(query), Asset.content.op("%>")(phrase)),
+    )
+
+    combined = union_all(projects, assets).subquery()
+    ranked = select(combined)
+    if position is not None:
+        score, kind, hit_id = position
+        ranked = ranked.where(or_(
+            combined.c.score < score,
+            and_(combined.c.score == score, or_(
+                combined.c.kind < kind,
+                and_(combined.c.kind == kind, combined.c.id > hit_id),
+            )),
+        ))
+    # kind descending puts "project" before "asset", matching KIND_ORDER
+    rows = (await session.exec(ranked.order_by(combined.c.score.desc(), combined.c.kind.desc(), combined.c.id).limit(limit))).all()
+
+    asset_ids = [row.id for row in rows if row.kind == "asset"]
+    contents = {}
+    if asset_ids:
+        contents = dict((await session.exec(select(Asset.id, Asset.content).where(Asset.id.in_(asset_ids)))).all())
+    return [
+        SearchHit(
+            kind=row.kind,
+            id=row.id,
+            project_id=row.project_id,
+            project_name=row.project_name,
+            snippet=snippet(contents.get(row.id), terms) if row.kind == "asset" else None,
+            score=float(row.score),
+        )
+        for row in rows
+    ]
+
+# Ranked search over the project names and text assets the user can view
+async def search(session: AsyncSession, user_id: int, q: str, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> SearchPage:
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    position = decode_cursor(cursor) if cursor else None
+    terms = list(dict.fromkeys(tokenize(q)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return SearchPage(items=[])
+    backend = _search_postgres if SEARCH_BACKEND == "postgres" else _search_memory
+    hits = await backend(session, user_id, terms, position, limit + 1)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    next_cursor = encode_cursor(round(hits[-1].score, 6), hits[-1].kind, hits[-1].id) if has_more else None
+    return SearchPage(items=hits, next_cursor=next_cursor)
+
+router = APIRouter()
+
+@router.get("/api/search", response_model=SearchPage)
+async def search_endpoint(q: str, session: AsyncSessionDep, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, user: UserSnapshot = Depends(require_user)):
+    try:
+        return await search(session, user.id, q, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
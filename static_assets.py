@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from typing import Dict, List, Optional
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+from storage import BlobResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Source files live in static/; fingerprinted copies and their compressed
+# variants are written to STATIC_BUILD_DIR along with manifest.json
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", "storage/static")
+STATIC_URL_PREFIX = "/static/"
+# Set when the build step already ran `python static_assets.py`; workers then
+# just read manifest.json instead of hashing every file at boot
+STATIC_PREBUILT = os.getenv("STATIC_PREBUILT", "false").lower() in ("1", "true", "yes")
+
+# Already-compressed formats gain nothing from gzip/brotli
+PRECOMPRESSED_TYPES = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".woff2", ".zip"}
+MIN_COMPRESS_BYTES = 512
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+def _fingerprinted_name(relative_path: str, digest: str) -> str:
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{digest[:12]}{ext}"
+
+def _hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _brotli_compress(data: bytes) -> Optional[bytes]:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+def _write_atomic(target: str, data: bytes) -> None:
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(data)
+    os.replace(tmp, target)
+
+# Write the compressed variants of `target` that are meaningfully smaller
+def _write_variants(target: str) -> List[str]:
+    with open(target, "rb") as file:
+        data = file.read()
+    encodings = []
+    for encoding, compress in (("br", _brotli_compress), ("gzip", lambda d: gzip.compress(d, 9, mtime=0))):
+        variant = target + ENCODING_SUFFIXES[encoding]
+        if not os.path.exists(variant):
+            compressed = compress(data)
+            if compressed is None or len(compressed) > len(data) * 0.9:
+                continue
+            _write_atomic(variant, compressed)
+        encodings.append(encoding)
+    return encodings
+
+# Fingerprint every file under `source` into `build_dir` and write the
+# manifest. Outputs are content-addressed, so unchanged files are skipped and
+# rebuilding at startup only costs a hash per file.
+def build_static(source: str = STATIC_DIR, build_dir: str = STATIC_BUILD_DIR) -> Dict[str, dict]:
+    manifest: Dict[str, dict] = {}
+    for directory, _, files in os.walk(source):
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, source).replace(os.sep, "/")
+            digest = _hash_file(path)
+            hashed = _fingerprinted_name(relative, digest)
+            target = os.path.join(build_dir, hashed)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(path, target + ".tmp")
+                os.replace(target + ".tmp", target)
+            encodings = []
+            ext = os.path.splitext(name)[1].lower()
+            if ext not in PRECOMPRESSED_TYPES and os.path.getsize(target) >= MIN_COMPRESS_BYTES:
+                encodings = _write_variants(target)
+            manifest[relative] = {"path": hashed, "sha256": digest, "encodings": encodings}
+    os.makedirs(build_dir, exist_ok=True)
+    _write_atomic(os.path.join(build_dir, "manifest.json"), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+# Manifest for the running worker: the prebuilt one when available,
+# otherwise build (or refresh) it now
+def load_static(source: str = STATIC_DIR, build_dir: str = STATIC_BUILD_DIR, prebuilt: bool = STATIC_PREBUILT) -> Dict[str, dict]:
+    if prebuilt:
+        try:
+            with open(os.path.join(build_dir, "manifest.json"), "rb") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            pass
+    return build_static(source, build_dir)
+
+class StaticManifest:
+    def __init__(self, entries: Dict[str, dict], build_dir: str = STATIC_BUILD_DIR):
+        self.entries = entries
+        self.build_dir = build_dir
+        self.by_hashed = {entry["path"]: entry for entry in entries.values()}
+
+    # Template helper: {{ static_url('js/drawing.js') }}. Unknown files fall
+    # back to their plain URL so a missing build never breaks a page.
+    def url(self, path: str) -> str:
+        path = path.lstrip("/")
+        if path.startswith("static/"):
+            path = path[len("static/"):]
+        entry = self.entries.get(path)
+        return STATIC_URL_PREFIX + (entry["path"] if entry else path)
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+def choose_encoding(header: str, available: List[str]) -> Optional[str]:
+    accepted = _accepted_encodings(header or "")
+    for encoding in ("br", "gzip"):
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if encoding in available and quality > 0:
+            return encoding
+    return None
+
+# Serves fingerprinted URLs from the build directory with immutable caching,
+# picking the br/gzip variant the client accepts and sending it zero-copy
+# through BlobResponse. Plain URLs are served from static/ as before, but
+# must revalidate since their content can change in place.
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *, manifest: StaticManifest, **kwargs):
+        super().__init__(**kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope: Scope):
+        entry = self.manifest.by_hashed.get(path.replace(os.sep, "/"))
+        if entry is None or scope["method"] not in ("GET", "HEAD"):
+            response = await super().get_response(path, scope)
+            if response.status_code in (200, 304):
+                response.headers["cache-control"] = "public, no-cache"
+            return response
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""), entry["encodings"])
+        file_path = os.path.join(self.manifest.build_dir, entry["path"])
+        if encoding is not None:
+            file_path += ENCODING_SUFFIXES[encoding]
+        stat = os.stat(file_path)
+        media_type = mimetypes.guess_type(entry["path"])[0] or "application/octet-stream"
+        response = BlobResponse(
+            file_path,
+            f"{entry['sha256'][:16]}-{encoding or 'identity'}",
+            media_type,
+            stat.st_size,
+            stat.st_mtime,
+            request_headers,
+            cache_control="public, max-age=31536000, immutable",
+        )
+        if encoding is not None:
+            response.headers["content-encoding"] = encoding
+        if entry["encodings"]:
+            response.headers["vary"] = "Accept-Encoding"
+        return response
+
+if __name__ == "__main__":
+    entries = build_static()
+    compressed = sum(1 for entry in entries.values() if entry["encodings"])
+    print(f"Built {len(entries)} static files ({compressed} with compressed variants) into {STATIC_BUILD_DIR}")
@@ -0,0 +1,219 @@
+import hashlib
+import os
+import re
+import tempfile
+from email.utils import formatdate
+from typing import Dict, List, Optional, Tuple
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Root directory of the content-addressed blob store
+ASSET_STORAGE_DIR = os.getenv("ASSET_STORAGE_DIR", "storage/blobs")
+ASSET_MAX_BYTES = int(os.getenv("ASSET_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class BlobTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+class DigestMismatch(Exception):
+    """Raised when uploaded bytes don't hash to the digest the client declared."""
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST_RE.match(value or ""))
+
+# Local-disk blob store keyed by SHA-256. Blobs live at ab/cd/<digest> so no
+# single directory grows too large; identical content is stored once.
+class BlobStore:
+    def __init__(self, root: str = ASSET_STORAGE_DIR):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def relative_path(self, digest: str) -> str:
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def exists(self, digest: str) -> bool:
+        return is_digest(digest) and os.path.isfile(self.path(digest))
+
+    def writer(self, expected_digest: Optional[str] = None, max_bytes: int = ASSET_MAX_BYTES) -> "BlobWriter":
+        return BlobWriter(self, expected_digest, max_bytes)
+
+    def open(self, digest: str):
+        return open(self.path(digest), "rb")
+
+# Hashes an upload while it streams in. Bytes go to a temp file in the store
+# and are renamed into place on commit; if the client declared a digest that
+# is already stored, nothing is written and the bytes are only verified.
+class BlobWriter:
+    def __init__(self, store: BlobStore, expected_digest: Optional[str], max_bytes: int):
+        self.store = store
+        self.expected_digest = expected_digest if is_digest(expected_digest or "") else None
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.deduplicated = self.expected_digest is not None and store.exists(self.expected_digest)
+        self._hash = hashlib.sha256()
+        self._file = None
+        if not self.deduplicated:
+            self._file = tempfile.NamedTemporaryFile(dir=store.tmp_dir, delete=False)
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.abort()
+            raise BlobTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        self._hash.update(data)
+        if self._file is not None:
+            self._file.write(data)
+
+    def write_many(self, chunks: List[bytes]) -> None:
+        for chunk in chunks:
+            self.write(chunk)
+
+    # Returns the digest of the committed blob
+    def commit(self) -> str:
+        digest = self._hash.hexdigest()
+        if self.expected_digest is not None and digest != self.expected_digest:
+            self.abort()
+            raise DigestMismatch("Uploaded content does not match the declared sha256")
+        if self._file is None:
+            return digest
+        self._file.close()
+        target = self.store.path(digest)
+        if os.path.exists(target):
+            os.unlink(self._file.name)
+            self.deduplicated = True
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(self._file.name, target)
+        self._file = None
+        return digest
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except FileNotFoundError:
+                pass
+            self._file = None
+
+# Parse a single "bytes=" range against a file size. Returns None when the
+# header should be ignored (missing, multi-range or malformed) and raises
+# ValueError when the range can't be satisfied.
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    spec = header[len("bytes="):].strip()
+    start_s, _, end_s = spec.partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError("Unsatisfiable range")
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+    except ValueError as e:
+        if "Unsatisfiable" in str(e):
+            raise
+        return None
+    end = min(end, size - 1)
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+# Blobs are user content served from the app origin. An SVG opened directly
+# must not run scripts or load anything with the viewer's cookies, and
+# browsers must not sniff a blob into a more dangerous type.
+BLOB_SECURITY_HEADERS = {
+    "content-security-policy": "sandbox; default-src 'none'; style-src 'unsafe-inline'",
+    "x-content-type-options": "nosniff",
+}
+
+# Streams (part of) a blob. Uses the ASGI zero-copy send extension when the
+# server offers it and falls back to chunked reads otherwise.
+class BlobResponse(Response):
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, digest: str, media_type: str, size: int, mtime: float,
+                 request_headers=None, cache_control: str = "private, max-age=0, must-revalidate",
+                 extra_headers: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        self.offset = 0
+        self.length = size
+        self.send_body = True
+        etag = f'"{digest}"'
+        headers = {
+            "etag": etag,
+            "accept-ranges": "bytes",
+            "cache-control": cache_control,
+            "last-modified": formatdate(mtime, usegmt=True),
+            **(extra_headers or {}),
+        }
+        request_headers = request_headers or {}
+        if etag in [tag.strip() for tag in request_headers.get("if-none-match", "").split(",")] or request_headers.get("if-none-match") == "*":
+            self.status_code = 304
+            self.send_body = False
+            self.init_headers(headers)
+            return
+        byte_range = None
+        if_range = request_headers.get("if-range")
+        if if_range is None or if_range == etag:
+            try:
+                byte_range = parse_range(request_headers.get("range"), size)
+            except ValueError:
+                self.status_code = 416
+                self.send_body = False
+                headers["content-range"] = f"bytes */{size}"
+                headers["content-length"] = "0"
+                self.init_headers(headers)
+                return
+        if byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset = start
+            self.length = end - start + 1
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+        else:
+            self.status_code = 200
+        headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or scope["method"].upper() == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.offset,
+                    "count": self.length,
+                })
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+blob_store = BlobStore()
@@ -0,0 +1,579 @@
+import io
+import logging
+import math
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+from metrics import Counter, Histogram
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Applied to uploaded SVGs and to compacted vector documents
+SVG_OPTIMIZE = os.getenv("SVG_OPTIMIZE", "true").lower() in ("1", "true", "yes")
+SVG_PRECISION = int(os.getenv("SVG_PRECISION", "2"))  # decimal places kept in coordinates of drawings 100+ units across
+
+SVG_OPTIMIZE_LATENCY = Histogram("svg_optimize_duration_seconds", "SVG optimizer run time", (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+SVG_OPTIMIZE_BYTES = Counter("svg_optimize_bytes_total", "SVG bytes through the optimizer, before and after")
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+# Editor state that never renders: svg.js selection helpers and the
+# Inkscape/Sodipodi namespaces
+HELPER_CLASSES = {"bounding-box", "anchor-point", "control-point", "control-line"}
+EDITOR_NAMESPACES = {"http://www.inkscape.org/namespaces/inkscape", "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"}
+# Whitespace is significant inside these
+TEXT_ELEMENTS = {"text", "tspan", "textPath", "style", "title", "desc", "script"}
+COORDINATE_ATTRS = {"x", "y", "width", "height", "cx", "cy", "r", "rx", "ry", "x1", "y1", "x2", "y2", "dx", "dy", "stroke-width", "font-size"}
+# Defaults that aren't inherited, so dropping them can't change a child's rendering
+NON_INHERITED_DEFAULTS = {"opacity": "1"}
+
+NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+FULL_NUMBER_RE = re.compile(rf"^\s*{NUMBER_RE.pattern}\s*$")
+
+@dataclass
+class SvgStats:
+    original_bytes: int
+    optimized_bytes: int
+    elements_removed: int
+    classes_created: int
+    seconds: float
+
+    @property
+    def saved_ratio(self) -> float:
+        return 1 - self.optimized_bytes / self.original_bytes if self.original_bytes else 0.0
+
+    @property
+    def throughput(self) -> float:  # input bytes per second
+        return self.original_bytes / self.seconds if self.seconds else 0.0
+
+def format_number(value: float, precision: int) -> str:
+    text = f"{value:.{precision}f}"
+    if precision > 0:
+        text = text.rstrip("0").rstrip(".")
+    if text[0] == "-":
+        if text == "-0":
+            return "0"
+        return "-" + text[2:] if text.startswith("-0.") else text
+    return text[1:] if text.startswith("0.") else text
+
+# Decimal places for a drawing `extent` user units across: `precision` from
+# 100 units up, one more for each factor of ten below, so rounding moves
+# points by the same fraction of the drawing at any scale
+def scaled_precision(precision: int, extent: Optional[float]) -> int:
+    if not extent or extent <= 0 or not math.isfinite(extent):
+        return precision
+    return precision + max(0, 2 - math.floor(math.log10(extent)))
+
+# Larger side of the root's viewBox, or of its width/height in user units
+def _drawing_extent(root: ET.Element) -> Optional[float]:
+    view_box = NUMBER_RE.findall(root.get("viewBox", ""))
+    if len(view_box) == 4:
+        return max(abs(float(view_box[2])), abs(float(view_box[3])))
+    sizes = [re.fullmatch(rf"\s*({NUMBER_RE.pattern})\s*(?:px)?\s*", root.get(name, "")) for name in ("width", "height")]
+    sizes = [float(match.group(1)) for match in sizes if match]
+    return max(sizes) if sizes else None
+
+def _round_numbers(value: str, precision: int) -> str:
+    return NUMBER_RE.sub(lambda match: format_number(float(match.group()), precision), value)
+
+# Path data
+
+_PATH_TOKEN_RE = re.compile(r"[MmZzLlHhVvCcSsQqTtAa]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_PATH_CHARS_RE = re.compile(r"[\sMmZzLlHhVvCcSsQqTtAa\d.,eE+-]*")
+PARAM_COUNTS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2, "A": 7, "Z": 0}
+
+# Parse path data into absolute segments: (command, args). Arc flags may be
+# written without separators ("a5 5 0 011 1"), so a flag token longer than
+# one digit is split. Malformed data raises ValueError.
+def parse_path(d: str) -> List[Tuple[str, List[float]]]:
+    if not _PATH_CHARS_RE.fullmatch(d):
+        raise ValueError("Unexpected characters in path data")
+    tokens = _PATH_TOKEN_RE.findall(d)
+    segments: List[Tuple[str, List[float]]] = []
+    position, end = 0, len(tokens)
+    command = None
+    x = y = start_x = start_y = 0.0
+    while position < end:
+        token = tokens[position]
+        if token.isalpha():
+            command = token
+            position += 1
+            if command in "Zz":
+                segments.append(("Z", []))
+                x, y = start_x, start_y
+                continue
+        elif command is None:
+            raise ValueError("Path data must start with a command")
+        elif command in "Zz":
+            raise ValueError("Numbers after closepath")
+        upper = command.upper()
+        if not segments and upper != "M":
+            raise ValueError("Path data must start with a moveto")
+        count = PARAM_COUNTS[upper]
+        if upper == "A":
+            for index in (3, 4):
+                flag = tokens[position + index] if position + index < end else ""
+                if len(flag) > 1 and flag[0] in "01":
+                    tokens[position + index:position + index + 1] = [flag[0], flag[1:]]
+                    end += 1
+        args = tokens[position:position + count]
+        if len(args) < count or any(arg.isalpha() for arg in args):
+            raise ValueError(f"Missing {upper} parameters")
+        args = [float(arg) for arg in args]
+        position += count
+        if command.islower():
+            if upper == "H":
+                args[0] += x
+            elif upper == "V":
+                args[0] += y
+            elif upper == "A":
+                args[5] += x
+                args[6] += y
+            else:
+                for index in range(0, count, 2):
+                    args[index] += x
+                    args[index + 1] += y
+        if upper == "H":
+            x = args[0]
+        elif upper == "V":
+            y = args[0]
+        else:
+            x, y = args[-2], args[-1]
+        if upper == "M":
+            start_x, start_y = x, y
+            # Extra coordinate pairs after a moveto are linetos
+            command = "l" if command == "m" else "L"
+        segments.append((upper, args))
+    return segments
+
+def _collinear(ax: float, ay: float, bx: float, by: float, cx: float, cy: float) -> bool:
+    # b lies on the segment direction from a, and c continues the same way
+    cross = (bx - ax) * (cy - by) - (by - ay) * (cx - bx)
+    dot = (bx - ax) * (cx - bx) + (by - ay) * (cy - by)
+    return abs(cross) < 1e-9 and dot >= 0
+
+# Round to `precision`, turn axis-aligned lines into H/V, drop zero-length
+# lines and merge consecutive collinear ones
+def _simplify(segments: List[Tuple[str, List[float]]], precision: int) -> List[Tuple[str, List[float]]]:
+    out: List[Tuple[str, List[float]]] = []
+    x = y = start_x = start_y = 0.0
+    line_from: Optional[Tuple[float, float]] = None  # start of the last emitted line segment
+    for command, args in segments:
+        args = [round(value, precision) if not (command == "A" and index in (3, 4)) else value for index, value in enumerate(args)]
+        if command == "Z":
+            # A final line back to the start is implied by closepath
+            if out and out[-1][0] in "LHV" and (x, y) == (start_x, start_y) and line_from is not None and out[-2:-1] and out[-2][0] != "M":
+                out.pop()
+            out.append(("Z", []))
+            x, y = start_x, start_y
+            line_from = None
+            continue
+        if command in "LHV":
+            target_x = args[0] if command in "LH" else x
+            target_y = args[-1] if command in "LV" else y
+            if (target_x, target_y) == (x, y) and out and out[-1][0] != "M":
+                continue
+            if line_from is not None and out[-1][0] in "LHV" and _collinear(line_from[0], line_from[1], x, y, target_x, target_y):
+                out.pop()
+                x, y = line_from
+            else:
+                line_from = (x, y)
+            if target_y == y and target_x != x:
+                out.append(("H", [target_x]))
+            elif target_x == x and target_y != y:
+                out.append(("V", [target_y]))
+            else:
+                out.append(("L", [target_x, target_y]))
+            x, y = target_x, target_y
+            continue
+        line_from = None
+        out.append((command, args))
+        x, y = args[-2], args[-1]
+        if command == "M":
+            start_x, start_y = x, y
+    return out
+
+def _join_numbers(numbers: List[str]) -> str:
+    text = ""
+    for number in numbers:
+        if text and not (number[0] == "-" or (number[0] == "." and "." in _last_number(text))):
+            text += " "
+        text += number
+    return text
+
+def _last_number(text: str) -> str:
+    match = re.search(r"[-+]?[\d.]+(?:[eE][-+]?\d+)?$", text)
+    return match.group() if match else ""
+
+# Serialize with whichever of the absolute or relative form is shorter for
+# each segment. Relative offsets are taken from the rounded position, so
+# rounding error doesn't accumulate along the path.
+def serialize_path(segments: List[Tuple[str, List[float]]], precision: int) -> str:
+    parts: List[str] = []
+    previous = ""
+    x = y = start_x = start_y = 0.0
+    for command, args in segments:
+        if command == "Z":
+            letter, numbers = "z", []
+            x, y = start_x, start_y
+        else:
+            fmt = lambda value: format_number(value, precision)
+            if command == "H":
+                absolute, relative = [fmt(args[0])], [fmt(args[0] - x)]
+            elif command == "V":
+                absolute, relative = [fmt(args[0])], [fmt(args[0] - y)]
+            elif command == "A":
+                fixed = [fmt(args[0]), fmt(args[1]), fmt(args[2]), str(int(args[3])), str(int(args[4]))]
+                absolute = fixed + [fmt(args[5]), fmt(args[6])]
+                relative = fixed + [fmt(args[5] - x), fmt(args[6] - y)]
+            else:
+                absolute = [fmt(value) for value in args]
+                relative = [fmt(value - (x if index % 2 == 0 else y)) for index, value in enumerate(args)]
+            use_relative = len(_join_numbers(relative)) < len(_join_numbers(absolute))
+            letter = command.lower() if use_relative else command
+            numbers = relative if use_relative else absolute
+            if command == "H":
+                x = args[0]
+            elif command == "V":
+                y = args[0]
+            else:
+                x, y = args[-2], args[-1]
+            if command == "M":
+                start_x, start_y = x, y
+        implicit = {"M": "L", "m": "l"}.get(previous, previous)
+        if letter != implicit or letter in "zZ" or previous in "zZ" or not numbers:
+            parts.append(letter)
+            body = _join_numbers(numbers)
+        else:
+            body = _join_numbers(numbers)
+            # Repeated command: the numbers continue the previous run
+            if not (body[0] == "-" or (body[0] == "." and "." in _last_number(parts[-1]))):
+                body = " " + body
+        parts.append(body)
+        previous = letter
+    return "".join(parts)
+
+def optimize_path(d: str, precision: int = SVG_PRECISION) -> str:
+    return serialize_path(_simplify(parse_path(d), precision), precision)
+
+# Style attributes
+
+def normalize_style(style: str) -> str:
+    declarations: Dict[str, str] = {}
+    for declaration in style.split(";"):
+        name, _, value = declaration.partition(":")
+        name, value = name.strip().lower(), " ".join(value.split())
+        if name and value:
+            declarations.pop(name, None)
+            declarations[name] = value
+    return ";".join(f"{name}:{value}" for name, value in declarations.items())
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+def _namespace(tag: str) -> str:
+    return tag[1:].split("}", 1)[0] if tag.startswith("{") else ""
+
+def _is_helper(element: ET.Element) -> bool:
+    if _namespace(element.tag) in EDITOR_NAMESPACES:
+        return True
+    classes = element.get("class")
+    return bool(classes) and not HELPER_CLASSES.isdisjoint(classes.split())
+
+def _escape_text(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _escape_attr(value: str) -> str:
+    return _escape_text(value).replace('"', "&quot;").replace("\n", "&#10;").replace("\t", "&#9;").replace("\r", "&#13;")
+
+# Elements are handled in document order and detached once closed, so the one
+# being closed is always its parent's first remaining child
+def _detach(parent: Optional[ET.Element], element: ET.Element) -> None:
+    if parent is not None and len(parent) and parent[0] is element:
+        del parent[0]
+
+Source = Union[bytes, str]
+
+def _open(source: Source) -> BinaryIO:
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+
+# First pass: count inline styles shared between rendered elements. Styles
+# are only moved into classes when the document has no <style> of its own,
+# whose selectors could outrank a class where they lost to an inline style,
+# and only when the classes save more bytes than the <style> element costs.
+def _plan_classes(source: Source) -> Dict[str, str]:
+    uses: Dict[str, List[int]] = {}  # style -> [elements, elements that already have a class]
+    existing_classes = set()
+    svg_prefix = ""
+    skip_depth = 0
+    parents: List[ET.Element] = []
+    with _open(source) as file:
+        for event, item in ET.iterparse(file, events=("start-ns", "start", "end")):
+            if event == "start-ns":
+                if item[1] == SVG_NS:
+                    svg_prefix = item[0]
+                continue
+            element = item
+            if event == "start":
+                parents.append(element)
+                if skip_depth or _is_helper(element):
+                    skip_depth += 1
+                    continue
+                if _local(element.tag) == "style":
+                    return {}
+                classes = element.get("class")
+                if classes:
+                    existing_classes.update(classes.split())
+                style = element.get("style")
+                if style:
+                    normalized = normalize_style(style)
+                    if normalized:
+                        counts = uses.setdefault(normalized, [0, 0])
+                        counts[0] += 1
+                        counts[1] += bool(classes)
+            else:
+                if skip_depth:
+                    skip_depth -= 1
+                parents.pop()
+                _detach(parents[-1] if parents else None, element)
+                element.clear()
+    classes: Dict[str, str] = {}
+    saved = 0
+    index = 0
+    for style, (count, with_class) in sorted(uses.items(), key=lambda item: -item[1][0] * len(item[0])):
+        if count < 2:
+            continue
+        name = f"o{index:x}"
+        while name in existing_classes:
+            index += 1
+            name = f"o{index:x}"
+        # ` style="…"` on every use, against ` class="…"` (or a name appended
+        # to an existing class) on every use plus one `.name{…}` rule
+        inline = count * (len(style) + 9)
+        as_class = (count - with_class) * (len(name) + 9) + with_class * (len(name) + 1) + len(name) + len(style) + 3
+        if inline <= as_class:
+            continue
+        classes[style] = name
+        saved += inline - as_class
+        index += 1
+    tag = f"{svg_prefix}:style" if svg_prefix else "style"
+    if saved <= 2 * len(tag) + 5:  # <style></style>
+        return {}
+    return classes
+
+class _Frame:
+    __slots__ = ("element", "name", "attrs", "opened", "skip", "droppable", "text_content", "scope")
+
+    def __init__(self, element, name, attrs, skip, droppable, text_content, scope):
+        self.element = element
+        self.name = name
+        self.attrs = attrs
+        self.opened = False
+        self.skip = skip
+        self.droppable = droppable
+        self.text_content = text_content
+        self.scope = scope  # prefix -> namespace in effect inside this element
+
+# Streaming rewrite: elements are written as the parser closes them and then
+# detached, so memory is bounded by nesting depth rather than document size.
+# An element's start tag is held back until it has output, which is how empty
+# groups (and groups holding only empty groups) disappear. Namespace
+# declarations stay on the element that made them (or are added where a name
+# needs one), so every prefix written is declared in its own scope.
+class _Rewriter:
+    def __init__(self, write: Callable[[str], None], precision: int, classes: Dict[str, str], editable: bool):
+        self.write = write
+        self.precision = precision
+        self.classes = classes
+        self.editable = editable
+        self.pending_ns: List[Tuple[str, str]] = []
+        self.stack: List[_Frame] = []
+        self.last_closed: Optional[ET.Element] = None
+        self.removed = 0
+
+    # Attributes never take the default namespace, so they need a real prefix
+    def qualify(self, tag: str, scope: Dict[str, str], declared: Dict[str, str], attribute: bool = False) -> str:
+        namespace = _namespace(tag)
+        if not namespace:
+            return tag
+        prefix = next((prefix for prefix, uri in scope.items() if uri == namespace and (prefix or not attribute)), None)
+        if prefix is None:
+            index = len(scope)
+            while f"ns{index}" in scope:
+                index += 1
+            prefix = f"ns{index}"
+            scope[prefix] = declared[prefix] = namespace
+        return f"{prefix}:{_local(tag)}" if prefix else _local(tag)
+
+    def attributes(self, element: ET.Element, scope: Dict[str, str], declared: Dict[str, str]) -> str:
+        parts = []
+        classes = element.get("class")
+        for key, value in element.attrib.items():
+            if _namespace(key) in EDITOR_NAMESPACES:
+                continue
+            name = self.qualify(key, scope, declared, attribute=True)
+            value = value.strip()
+            if not value or NON_INHERITED_DEFAULTS.get(name) == value:
+                continue
+            if name == "d":
+                try:
+                    value = optimize_path(value, self.precision)
+                except ValueError:
+                    pass
+            elif name == "points" or (name in COORDINATE_ATTRS and FULL_NUMBER_RE.match(value)):
+                value = _round_numbers(value, self.precision)
+            elif name == "style":
+                value = normalize_style(value)
+                class_name = self.classes.get(value)
+                if class_name:
+                    classes = f"{classes} {class_name}" if classes else class_name
+                    continue
+                if not value:
+                    continue
+            elif name == "class":
+                continue
+            parts.append(f' {name}="{_escape_attr(value)}"')
+        if classes:
+            parts.append(f' class="{_escape_attr(classes)}"')
+        declarations = [
+            f' xmlns:{prefix}="{_escape_attr(uri)}"' if prefix else f' xmlns="{_escape_attr(uri)}"'
+            for prefix, uri in declared.items()
+            if uri not in EDITOR_NAMESPACES
+        ]
+        return "".join(declarations + parts)
+
+    def _text(self, frame: Optional[_Frame], text: Optional[str]) -> str:
+        if not text:
+            return ""
+        if frame is not None and frame.text_content:
+            return _escape_text(text)
+        return _escape_text(text) if text.strip() else ""
+
+    def open_ancestors(self) -> None:
+        for index, frame in enumerate(self.stack):
+            if frame.opened:
+                continue
+            frame.opened = True
+            self.write(f"<{frame.name}{frame.attrs}>")
+            if index == 0 and self.classes:
+                rules = "".join(f".{name}{{{style}}}" for style, name in self.classes.items())
+                self.write(f"<{self._sibling_name('style')}>{_escape_text(rules)}</{self._sibling_name('style')}>")
+            self.write(self._text(frame, frame.element.text))
+
+    def _sibling_name(self, local: str) -> str:
+        prefix = next((prefix for prefix, uri in self.stack[0].scope.items() if uri == SVG_NS), "")
+        return f"{prefix}:{local}" if prefix else local
+
+    # Text after the previously closed sibling. The parser reads ahead, so a
+    # closed element is only cleared once its tail has been consumed here.
+    def flush_tail(self) -> None:
+        if self.last_closed is None:
+            return
+        element, self.last_closed = self.last_closed, None
+        parent = self.stack[-1] if self.stack else None
+        tail = self._text(parent, element.tail) if parent is not None and not parent.skip else ""
+        element.clear()
+        if tail:
+            self.open_ancestors()
+            self.write(tail)
+
+    def start(self, element: ET.Element) -> None:
+        self.flush_tail()
+        parent = self.stack[-1] if self.stack else None
+        declared = dict(self.pending_ns)
+        self.pending_ns = []
+        skip = (parent is not None and parent.skip) or _is_helper(element)
+        if skip:
+            self.stack.append(_Frame(element, "", "", True, True, False, {}))
+            return
+        if parent is None:
+            self.precision = scaled_precision(self.precision, _drawing_extent(element))
+        scope = {**(parent.scope if parent is not None else {"xml": XML_NS}), **declared}
+        local = _local(element.tag)
+        droppable = local == "g" and parent is not None and not (self.editable and element.get("id"))
+        text_content = local in TEXT_ELEMENTS or (parent is not None and parent.text_content)
+        name = self.qualify(element.tag, scope, declared)
+        self.stack.append(_Frame(element, name, self.attributes(element, scope, declared), False, droppable, text_content, scope))
+
+    def end(self, element: ET.Element) -> None:
+        frame = self.stack[-1]
+        self.flush_tail()
+        self.stack.pop()
+        if frame.skip:
+            if not self.stack or not self.stack[-1].skip:
+                self.removed += 1
+        elif frame.opened:
+            self.write(f"</{frame.name}>")
+        else:
+            text = self._text(frame, element.text)
+            if frame.droppable and not text:
+                self.removed += 1
+            else:
+                self.open_ancestors()
+                self.write(f"<{frame.name}{frame.attrs}>{text}</{frame.name}>" if text else f"<{frame.name}{frame.attrs}/>")
+        _detach(self.stack[-1].element if self.stack else None, element)
+        self.last_closed = element
+
+    # Declarations arrive just before the start of the element making them
+    def namespace(self, prefix: str, uri: str) -> None:
+        self.pending_ns.append((prefix, uri))
+
+# Optimize `source` (document bytes or a file path), passing output to
+# `write` in chunks of about `chunk_size` bytes. Two streaming passes: one
+# to plan shared style classes, one to rewrite. `editable` output stays
+# addressable by later vector ops: groups with ids are kept even when empty
+# and inline styles aren't moved into classes (a set_attributes op replacing
+# "class" would drop them).
+def optimize(source: Source, write: Callable[[bytes], None], precision: int = SVG_PRECISION,
+             editable: bool = False, chunk_size: int = 64 * 1024) -> SvgStats:
+    started = time.perf_counter()
+    original_bytes = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    classes = {} if editable else _plan_classes(source)
+    buffer: List[str] = []
+    buffered = 0
+    written = 0
+
+    def emit(text: str) -> None:
+        nonlocal buffered, written
+        buffer.append(text)
+        buffered += len(text)
+        if buffered >= chunk_size:
+            data = "".join(buffer).encode()
+            written += len(data)
+            write(data)
+            buffer.clear()
+            buffered = 0
+
+    rewriter = _Rewriter(emit, precision, classes, editable)
+    with _open(source) as file:
+        for event, item in ET.iterparse(file, events=("start-ns", "start", "end")):
+            if event == "start-ns":
+                rewriter.namespace(*item)
+            elif event == "start":
+                rewriter.start(item)
+            else:
+                rewriter.end(item)
+    data = "".join(buffer).encode()
+    if data:
+        written += len(data)
+        write(data)
+    stats = SvgStats(original_bytes, written, rewriter.removed, len(classes), time.perf_counter() - started)
+    SVG_OPTIMIZE_LATENCY.observe(stats.seconds)
+    SVG_OPTIMIZE_BYTES.inc(original_bytes, stage="input")
+    SVG_OPTIMIZE_BYTES.inc(written, stage="output")
+    logger.info(
+        "Optimized SVG %d -> %d bytes (%.1f%% smaller) in %.1f ms, %.1f MB/s",
+        original_bytes, written, stats.saved_ratio * 100, stats.seconds * 1000, stats.throughput / 1e6,
+    )
+    return stats
+
+def optimize_string(content: str, precision: int = SVG_PRECISION, editable: bool = False) -> Tuple[str, SvgStats]:
+    chunks: List[bytes] = []
+    stats = optimize(content.encode(), chunks.append, precision, editable)
+    return b"".join(chunks).decode(), stats
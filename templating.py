@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+from typing import Dict, Tuple
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, Template, nodes
+from jinja2.ext import Extension
+from metrics import TEMPLATE_RENDER_LATENCY, record_timing
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Compiled templates are kept on disk so a fresh worker loads bytecode
+# instead of re-parsing; entries are keyed by template source checksum
+TEMPLATE_DIR = os.getenv("TEMPLATE_DIR", "templates")
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "storage/template_cache")
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "true").lower() in ("1", "true", "yes")
+
+# Render time per top-level template: count, total and max seconds
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs) -> str:
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            _record_render(self.name, time.perf_counter() - start)
+
+_render_stats: Dict[str, list] = {}
+
+def _record_render(name: str, elapsed: float) -> None:
+    stats = _render_stats.setdefault(name, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] = max(stats[2], elapsed)
+    TEMPLATE_RENDER_LATENCY.observe(elapsed, template=name)
+    record_timing("template", elapsed)
+
+def render_stats() -> Dict[str, dict]:
+    return {
+        name: {"renders": count, "avg_ms": round(total / count * 1000, 3), "max_ms": round(worst * 1000, 3)}
+        for name, (count, total, worst) in _render_stats.items()
+    }
+
+# {% cache "sidebar" %}...{% endcache %} renders its body once and reuses the
+# output. Only wrap markup that does not depend on the user or request. The
+# key includes the template's mtime at compile time, so editing the template
+# (which triggers a recompile) retires the old fragment.
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache={})
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        mtime = os.path.getmtime(parser.filename) if parser.filename else 0.0
+        args = [nodes.Const(parser.name), nodes.Const(mtime), key]
+        return nodes.CallBlock(self.call_method("_render_cached", args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, name: str, mtime: float, key: str, caller) -> str:
+        cache: Dict[Tuple[str, str], Tuple[float, str]] = self.environment.fragment_cache
+        cached = cache.get((name, key))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        output = caller()
+        cache[(name, key)] = (mtime, output)
+        return output
+
+def create_templates(directory: str = TEMPLATE_DIR, cache_dir: str = TEMPLATE_CACHE_DIR) -> Jinja2Templates:
+    os.makedirs(cache_dir, exist_ok=True)
+    templates = Jinja2Templates(
+        directory=directory,
+        bytecode_cache=FileSystemBytecodeCache(cache_dir),
+        auto_reload=TEMPLATE_AUTO_RELOAD,
+        extensions=[FragmentCacheExtension],
+    )
+    templates.env.template_class = TimedTemplate
+    return templates
+
+# Load every template once so compile (or bytecode load) cost is paid at
+# startup rather than by the first request to each page
+def warm_up(templates: Jinja2Templates) -> float:
+    start = time.perf_counter()
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.get_template(name)
+    elapsed = time.perf_counter() - start
+    logger.info("Warmed templates in %.1f ms", elapsed * 1000)
+    return elapsed
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Sequence
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import AsyncSessionDep, async_session_maker
+from models import Asset, Project, ThumbnailJob
+from auth import require_user
+from authz import memberships_for, organizations_allowing
+from storage import blob_store, is_digest
+from user_cache import UserSnapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail settings; sizes are the longest edge in pixels
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "storage/thumbnails")
+THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv("THUMBNAIL_SIZES", "64,256,512").split(","))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_POLL_INTERVAL = float(os.getenv("THUMBNAIL_POLL_INTERVAL", "5"))
+THUMBNAIL_MAX_ATTEMPTS = 3
+THUMBNAIL_STALE_AFTER = timedelta(minutes=10)
+PLACEHOLDER_PATH = "static/images/thumbnail_placeholder.svg"
+
+router = APIRouter()
+
+def thumbnail_path(digest: str, size: int) -> str:
+    return os.path.join(THUMBNAIL_DIR, digest[:2], f"{digest}_{size}.png")
+
+# Thumbnails are keyed by content hash, so identical blobs share one set
+def thumbnails_ready(digest: str, sizes: Sequence[int] = THUMBNAIL_SIZES) -> bool:
+    return all(os.path.isfile(thumbnail_path(digest, size)) for size in sizes)
+
+# SVG previews need cairosvg and the system cairo library. Checked once, on
+# the first vector job, so the import stays out of the boot path.
+@lru_cache(maxsize=1)
+def svg_previews_available() -> bool:
+    try:
+        import cairosvg  # noqa: F401
+    except (ImportError, OSError) as e:
+        logger.warning("SVG thumbnails disabled: %s", e)
+        return False
+    return True
+
+def can_render(asset_type: str) -> bool:
+    return asset_type == "bitmap" or (asset_type == "vector" and svg_previews_available())
+
+def _save_atomic(image, target: str) -> None:
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmp:
+        image.save(tmp, "PNG", optimize=True)
+    os.replace(tmp_path, target)
+
+# Runs in a worker process: render every configured size for one blob
+def render_thumbnails(source_path: str, mime_type: str, digest: str, sizes: Sequence[int]) -> None:
+    import io
+    from PIL import Image
+
+    if mime_type == "image/svg+xml":
+        try:
+            import cairosvg
+        except ImportError:
+            raise RuntimeError("SVG previews need the optional cairosvg package")
+        largest = max(sizes)
+        png = cairosvg.svg2png(url=source_path, output_width=largest)
+        source = Image.open(io.BytesIO(png))
+    else:
+        source = Image.open(source_path)
+    source.load()
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA")
+    # Render largest first and downscale from it; each step is cheaper than
+    # resampling the full-size original again
+    for size in sorted(sizes, reverse=True):
+        source.thumbnail((size, size), Image.LANCZOS)
+        _save_atomic(source, thumbnail_path(digest, size))
+
+# Queue a thumbnail job for the asset's current content. Jobs are unique per
+# (asset, content hash), so re-saving unchanged content never queues twice.
+# Vector assets keep the placeholder when SVG rendering isn't installed,
+# rather than piling up failed jobs.
+async def enqueue_thumbnail(session: AsyncSession, asset: Asset) -> Optional[ThumbnailJob]:
+    if not asset.content_hash or not can_render(asset.type):
+        return None
+    existing = (await session.exec(
+        select(ThumbnailJob).where(ThumbnailJob.asset_id == asset.id, ThumbnailJob.content_hash == asset.content_hash)
+    )).first()
+    if existing is not None:
+        return existing
+    job = ThumbnailJob(asset_id=asset.id, content_hash=asset.content_hash)
+    if thumbnails_ready(asset.content_hash):
+        job.status = "done"
+    session.add(job)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return None
+    thumbnail_worker.wake()
+    return job
+
+# Polls the job table and renders pending jobs in a process pool. The table is
+# the queue, so pending work survives restarts and is shared between workers.
+class ThumbnailWorker:
+    def __init__(self, processes: int = THUMBNAIL_WORKERS, poll_interval: float = THUMBNAIL_POLL_INTERVAL):
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        if self._task is not None or self.processes <= 0:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        await self._requeue_stale()
+        while True:
+            try:
+                processed = await self._process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Thumbnail worker error")
+                processed = 0
+            if processed:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # Jobs left "running" by a worker that died go back to the queue
+    async def _requeue_stale(self) -> None:
+        async with async_session_maker() as session:
+            await session.exec(
+                update(ThumbnailJob)
+                .where(ThumbnailJob.status == "running", ThumbnailJob.updated_at < datetime.utcnow() - THUMBNAIL_STALE_AFTER)
+                .values(status="pending")
+            )
+            await session.commit()
+
+    async def _process_batch(self) -> int:
+        async with async_session_maker() as session:
+            jobs = (await session.exec(
+                select(ThumbnailJob.id, ThumbnailJob.content_hash, Asset.mime_type)
+                .join(Asset, Asset.id == ThumbnailJob.asset_id)
+                .where(ThumbnailJob.status == "pending")
+                .order_by(ThumbnailJob.id)
+                .limit(self.processes * 2)
+            )).all()
+        if not jobs:
+            return 0
+        await asyncio.gather(*(self._process(job_id, digest, mime_type) for job_id, digest, mime_type in jobs))
+        return len(jobs)
+
+    async def _process(self, job_id: int, digest: str, mime_type: Optional[str]) -> None:
+        # Claim the job; another worker may have taken it first
+        async with async_session_maker() as session:
+            result = await session.exec(
+                update(ThumbnailJob)
+                .where(ThumbnailJob.id == job_id, ThumbnailJob.status == "pending")
+                .values(status="running", attempts=ThumbnailJob.attempts + 1, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+            if result.rowcount != 1:
+                return
+
+        error = None
+        if not thumbnails_ready(digest):
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(
+                    self._executor, render_thumbnails, blob_store.path(digest), mime_type or "", digest, THUMBNAIL_SIZES
+                )
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+
+        async with async_session_maker() as session:
+            job = await session.get(ThumbnailJob, job_id)
+            if job is None:
+                return  # the asset and its job were deleted while rendering
+            if error is None:
+                job.status = "done"
+                job.error = None
+            else:
+                job.status = "failed" if job.attempts >= THUMBNAIL_MAX_ATTEMPTS else "pending"
+                job.error = error[:500]
+            job.updated_at = datetime.utcnow()
+            session.add(job)
+            await session.commit()
+
+thumbnail_worker = ThumbnailWorker()
+
+# Whether the user may view some asset holding this blob; one query against
+# the cached membership map
+async def _can_view_digest(session: AsyncSession, user_id: int, digest: str) -> bool:
+    memberships = await memberships_for(session, user_id)
+    visible = Project.owner_id == user_id
+    organization_ids = organizations_allowing(memberships)
+    if organization_ids:
+        visible = or_(visible, Project.organization_id.in_(organization_ids))
+    row = (await session.exec(
+        select(Asset.id).join(Project, Project.id == Asset.project_id).where(Asset.content_hash == digest, visible).limit(1)
+    )).first()
+    return row is not None
+
+# Serve a cached thumbnail, or the placeholder while its job is pending.
+# Never renders inline.
+@router.get("/thumbnails/{digest}/{size}")
+async def get_thumbnail(digest: str, size: int, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    if not is_digest(digest) or size not in THUMBNAIL_SIZES or not await _can_view_digest(session, user.id, digest):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not found")
+    path = thumbnail_path(digest, size)
+    if await anyio.to_thread.run_sync(os.path.isfile, path):
+        return FileResponse(path, media_type="image/png", headers={"cache-control": "private, max-age=31536000, immutable"})
+    return FileResponse(PLACEHOLDER_PATH, media_type="image/svg+xml", headers={"cache-control": "no-store"})
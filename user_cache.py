@@ -0,0 +1,159 @@
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from pydantic import BaseModel
+
+# Cached view of the authenticated user; carries only what pages need
+class UserSnapshot(BaseModel, frozen=True):
+    id: int
+    username: str
+    email: str
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# Invalidation backends let several workers drop each other's entries.
+# The local backend is a no-op for single-process deployments.
+class LocalInvalidationBackend:
+    def publish(self, kind: str, key: str) -> None:
+        pass
+
+    def poll(self) -> List[Tuple[str, str]]:
+        return []
+
+# Append-only invalidation log in a SQLite file shared by every worker on the host
+class SQLiteInvalidationBackend:
+    def __init__(self, path: str, retention: float = 3600):
+        self.path = path
+        self.retention = retention
+        self._conn = sqlite3.connect(path, timeout=1, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_cache_invalidations ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, key TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        row = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM user_cache_invalidations").fetchone()
+        self._last_seq = row[0]
+
+    def publish(self, kind: str, key: str) -> None:
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO user_cache_invalidations (kind, key, created_at) VALUES (?, ?, ?)", (kind, key, now)
+        )
+        self._conn.execute("DELETE FROM user_cache_invalidations WHERE created_at < ?", (now - self.retention,))
+
+    def poll(self) -> List[Tuple[str, str]]:
+        rows = self._conn.execute(
+            "SELECT seq, kind, key FROM user_cache_invalidations WHERE seq > ? ORDER BY seq", (self._last_seq,)
+        ).fetchall()
+        if rows:
+            self._last_seq = rows[-1][0]
+        return [(kind, key) for _, kind, key in rows]
+
+# Bounded LRU of token -> user snapshot. Entries expire after `ttl` seconds
+# or at the token's own `exp`, whichever comes first.
+class UserCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 60, backend=None, poll_interval: float = 1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend or LocalInvalidationBackend()
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[str, Tuple[UserSnapshot, float]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._last_poll = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[UserSnapshot]:
+        self._sync()
+        key = token_key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        snapshot, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return snapshot
+
+    def set(self, token: str, snapshot: UserSnapshot, token_exp: Optional[float] = None) -> None:
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        key = token_key(token)
+        self._remove(key)
+        self._entries[key] = (snapshot, expires_at)
+        self._by_user.setdefault(snapshot.username, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_token(self, token: str) -> None:
+        key = token_key(token)
+        self._remove(key)
+        self.backend.publish("token", key)
+
+    def invalidate_user(self, username: str) -> None:
+        self._drop_user(username)
+        self.backend.publish("user", username)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_user.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+        for kind, key in self.backend.poll():
+            if kind == "user":
+                self._drop_user(key)
+            else:
+                self._remove(key)
+
+    def _drop_user(self, username: str) -> None:
+        for key in list(self._by_user.get(username, ())):
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        username = entry[0].username
+        keys = self._by_user.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[username]
+
+# Module-level cache shared by the auth dependencies. Set USER_CACHE_SHARED_PATH
+# to a file path to share invalidations between workers on the same host.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SHARED_PATH = os.getenv("USER_CACHE_SHARED_PATH")
+
+user_cache = UserCache(
+    maxsize=USER_CACHE_SIZE,
+    ttl=USER_CACHE_TTL,
+    backend=SQLiteInvalidationBackend(USER_CACHE_SHARED_PATH) if USER_CACHE_SHARED_PATH else None,
+)
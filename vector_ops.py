@@ -0,0 +1,375 @@
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Annotated, Dict, List, Literal, Optional, Union
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from pydantic import BaseModel, Field, TypeAdapter
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from database import AsyncSessionDep, async_session_maker
+from models import Asset, AssetOperation, AssetSnapshot
+from assets import get_accessible_asset
+from auth import require_user
+from storage import blob_store
+from svg_optimize import SVG_OPTIMIZE, optimize_string
+from user_cache import UserSnapshot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Compact the op-log into a new snapshot after this many versions
+SNAPSHOT_INTERVAL = int(os.getenv("VECTOR_SNAPSHOT_INTERVAL", "50"))
+MAX_OPS_PER_BATCH = 500
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+ET.register_namespace("", SVG_NS)
+ET.register_namespace("xlink", XLINK_NS)
+EMPTY_DOCUMENT = f'<svg xmlns="{SVG_NS}" version="1.1" viewBox="0 0 2000 2000"><g id="layer1"/></svg>'
+
+router = APIRouter()
+
+# Edit operations. Elements are addressed by id; "parent" is None for the root
+class AddElement(BaseModel):
+    op: Literal["add_element"]
+    parent: Optional[str] = None
+    index: Optional[int] = None
+    markup: str
+
+class RemoveElement(BaseModel):
+    op: Literal["remove_element"]
+    id: str
+
+class UpdateElement(BaseModel):
+    op: Literal["update_element"]
+    id: str
+    markup: str
+
+class SetAttributes(BaseModel):
+    op: Literal["set_attributes"]
+    id: str
+    attrs: Dict[str, Optional[str]]  # None removes the attribute
+
+class ReorderLayer(BaseModel):
+    op: Literal["reorder_layer"]
+    id: str
+    index: int
+
+Operation = Annotated[
+    Union[AddElement, RemoveElement, UpdateElement, SetAttributes, ReorderLayer],
+    Field(discriminator="op"),
+]
+
+class OperationBatch(BaseModel):
+    base_version: int
+    ops: List[Operation]
+
+class SaveResult(BaseModel):
+    asset_id: int
+    version: int
+
+class VectorDocumentOut(BaseModel):
+    asset_id: int
+    version: int
+    snapshot_version: int
+    replayed_ops: int
+    content: str
+
+class HistoryEntry(BaseModel):
+    version: int
+    user_id: Optional[int]
+    op_count: int
+    created_at: datetime
+
+# Ops may not add scripting: no event handler attributes, and none of the
+# elements that run script or embed HTML
+BLOCKED_ELEMENTS = {"script", "foreignObject"}
+ATTRIBUTE_PREFIXES = {"xlink": XLINK_NS, "xml": XML_NS}
+_NCNAME_RE = re.compile(r"^[A-Za-z_][\w.\-]*$")
+
+def _local_name(name: str) -> str:
+    return name.rsplit("}", 1)[-1]
+
+def _is_event_handler(name: str) -> bool:
+    return _local_name(name).lower().startswith("on")
+
+# ElementTree key for a set_attributes name: a plain NCName, or an xlink:/xml:
+# name in Clark notation so serializing declares its namespace
+def _attribute_key(name: str) -> str:
+    prefix, _, local = name.rpartition(":")
+    if not _NCNAME_RE.match(local) or (prefix and prefix not in ATTRIBUTE_PREFIXES) or name == "xmlns":
+        raise ValueError(f"Invalid attribute name {name!r}")
+    if _is_event_handler(local):
+        raise ValueError(f"Event handler attributes are not allowed: {name!r}")
+    return f"{{{ATTRIBUTE_PREFIXES[prefix]}}}{local}" if prefix else local
+
+def _parse_fragment(markup: str) -> ET.Element:
+    wrapper = ET.fromstring(f'<svg xmlns="{SVG_NS}">{markup}</svg>')
+    if len(wrapper) != 1:
+        raise ValueError("Markup must contain exactly one element")
+    for node in wrapper[0].iter():
+        if _local_name(node.tag) in BLOCKED_ELEMENTS:
+            raise ValueError(f"<{_local_name(node.tag)}> is not allowed")
+        if any(_is_event_handler(name) for name in node.attrib):
+            raise ValueError("Event handler attributes are not allowed")
+    return wrapper[0]
+
+# Check an op before it is stored, raising ValueError (or ParseError for
+# markup) with a message for the client
+def validate_operation(op) -> None:
+    if isinstance(op, (AddElement, UpdateElement)):
+        _parse_fragment(op.markup)
+    elif isinstance(op, SetAttributes):
+        for name in op.attrs:
+            _attribute_key(name)
+
+# Mutable SVG tree with an id index so each op is O(1) to locate. Ops that
+# target ids which no longer exist are skipped, which keeps replay total even
+# when two editors raced on the same element; so are ops stored before
+# validate_operation checked them.
+class VectorDocument:
+    def __init__(self, content: str):
+        self.root = ET.fromstring(content)
+        self._by_id: Dict[str, ET.Element] = {}
+        self._parent: Dict[ET.Element, ET.Element] = {}
+        self._index_subtree(self.root, None)
+
+    def _index_subtree(self, element: ET.Element, parent: Optional[ET.Element]) -> None:
+        if parent is not None:
+            self._parent[element] = parent
+        element_id = element.get("id")
+        if element_id:
+            self._by_id[element_id] = element
+        for child in element:
+            self._index_subtree(child, element)
+
+    def _unindex_subtree(self, element: ET.Element) -> None:
+        self._parent.pop(element, None)
+        element_id = element.get("id")
+        if element_id and self._by_id.get(element_id) is element:
+            del self._by_id[element_id]
+        for child in element:
+            self._unindex_subtree(child)
+
+    def apply(self, op) -> bool:
+        if isinstance(op, AddElement):
+            parent = self.root if op.parent is None else self._by_id.get(op.parent)
+            if parent is None:
+                return False
+            try:
+                element = _parse_fragment(op.markup)
+            except (ET.ParseError, ValueError):
+                return False
+            index = len(parent) if op.index is None else max(0, min(op.index, len(parent)))
+            parent.insert(index, element)
+            self._index_subtree(element, parent)
+            return True
+        element = self._by_id.get(op.id)
+        if element is None:
+            return False
+        if isinstance(op, SetAttributes):
+            try:
+                attrs = {_attribute_key(name): value for name, value in op.attrs.items()}
+            except ValueError:
+                return False
+            for name, value in attrs.items():
+                if value is None:
+                    element.attrib.pop(name, None)
+                else:
+                    element.set(name, value)
+            if "id" in op.attrs:
+                self._unindex_subtree(element)
+                self._index_subtree(element, self._parent.get(element))
+            return True
+        parent = self._parent.get(element)
+        if parent is None:
+            return False
+        if isinstance(op, RemoveElement):
+            parent.remove(element)
+            self._unindex_subtree(element)
+        elif isinstance(op, UpdateElement):
+            try:
+                replacement = _parse_fragment(op.markup)
+            except (ET.ParseError, ValueError):
+                return False
+            position = list(parent).index(element)
+            parent.remove(element)
+            self._unindex_subtree(element)
+            parent.insert(position, replacement)
+            self._index_subtree(replacement, parent)
+        elif isinstance(op, ReorderLayer):
+            parent.remove(element)
+            parent.insert(max(0, min(op.index, len(parent))), element)
+        return True
+
+    def serialize(self) -> str:
+        return ET.tostring(self.root, encoding="unicode")
+
+_operation_adapter = TypeAdapter(Operation)
+
+def _load_op(raw: str):
+    return _operation_adapter.validate_json(raw)
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+# Content of version 0: the asset's stored document, or an empty one
+async def _initial_content(asset: Asset) -> str:
+    if asset.content:
+        return asset.content
+    if asset.content_hash and blob_store.exists(asset.content_hash):
+        return await anyio.to_thread.run_sync(_read_text, blob_store.path(asset.content_hash))
+    return EMPTY_DOCUMENT
+
+# Rebuild a document at `version` from the nearest snapshot at or before it
+# plus the ops recorded after that snapshot
+async def load_document(session: AsyncSession, asset: Asset, version: Optional[int] = None) -> VectorDocumentOut:
+    target = asset.version if version is None else version
+    if target < 0 or target > asset.version:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Version not found")
+    snapshot = (await session.exec(
+        select(AssetSnapshot)
+        .where(AssetSnapshot.asset_id == asset.id, AssetSnapshot.version <= target)
+        .order_by(AssetSnapshot.version.desc())
+        .limit(1)
+    )).first()
+    if snapshot is None:
+        base_version, content = 0, await _initial_content(asset)
+    else:
+        base_version, content = snapshot.version, snapshot.content
+    rows = (await session.exec(
+        select(AssetOperation.op)
+        .where(AssetOperation.asset_id == asset.id, AssetOperation.version > base_version, AssetOperation.version <= target)
+        .order_by(AssetOperation.version, AssetOperation.seq)
+    )).all()
+    if rows:
+        def replay():
+            document = VectorDocument(content)
+            for raw in rows:
+                document.apply(_load_op(raw))
+            return document.serialize()
+        content = await anyio.to_thread.run_sync(replay)
+    return VectorDocumentOut(
+        asset_id=asset.id,
+        version=target,
+        snapshot_version=base_version,
+        replayed_ops=len(rows),
+        content=content,
+    )
+
+# Write a snapshot of the latest version and mirror it into Asset.content. The
+# snapshot is optimized in editable mode so later ops still find their ids.
+async def compact(asset_id: int) -> None:
+    try:
+        async with async_session_maker() as session:
+            asset = await session.get(Asset, asset_id)
+            if asset is None:
+                return
+            document = await load_document(session, asset)
+            if document.replayed_ops == 0:
+                return
+            content = document.content
+            if SVG_OPTIMIZE:
+                content, _ = await anyio.to_thread.run_sync(lambda: optimize_string(content, editable=True))
+            session.add(AssetSnapshot(asset_id=asset.id, version=document.version, content=content))
+            asset.content = content
+            session.add(asset)
+            try:
+                await session.commit()
+            except IntegrityError:
+                # A concurrent compaction already wrote this version's snapshot
+                await session.rollback()
+    except Exception:
+        # Runs after the response; replay from the previous snapshot still works
+        logger.exception("Compacting vector asset %s failed", asset_id)
+
+async def _load_vector_asset(session: AsyncSession, user: UserSnapshot, asset_id: int, action: str = "view") -> Asset:
+    asset = await get_accessible_asset(session, user.id, asset_id, action)
+    if asset.type != "vector":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not a vector asset")
+    return asset
+
+async def _version_conflict(session: AsyncSession, asset_id: int):
+    await session.rollback()
+    current_version = (await session.exec(select(Asset.version).where(Asset.id == asset_id))).one()
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Version conflict; current version is {current_version}")
+
+# Append a batch of ops as the next version. Writes are proportional to the
+# batch, not the document; compaction happens after the response is sent.
+@router.post("/api/assets/{asset_id}/ops", response_model=SaveResult)
+async def save_operations(asset_id: int, batch: OperationBatch, background_tasks: BackgroundTasks, session: AsyncSessionDep, user: UserSnapshot = Depends(require_user)):
+    if not batch.ops or len(batch.ops) > MAX_OPS_PER_BATCH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Send between 1 and {MAX_OPS_PER_BATCH} ops")
+    for op in batch.ops:
+        try:
+            validate_operation(op)
+        except ET.ParseError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid element markup")
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    asset = await _load_vector_asset(session, user, asset_id, "edit")
+    new_version = batch.base_version + 1
+
+    # Optimistic concurrency: only the writer holding base_version wins. The
+    # UPDATE goes first so concurrent first saves queue on the row lock and
+    # the losers see a conflict instead of racing on the snapshot below.
+    result = await session.exec(
+        update(Asset)
+        .where(Asset.id == asset_id, Asset.version == batch.base_version)
+        .values(version=new_version, modified_at=datetime.utcnow())
+    )
+    if result.rowcount != 1:
+        await _version_conflict(session, asset_id)
+
+    # The first batch pins the pre-edit document as the version 0 snapshot
+    if batch.base_version == 0:
+        has_snapshot = (await session.exec(
+            select(AssetSnapshot.id).where(AssetSnapshot.asset_id == asset_id).limit(1)
+        )).first()
+        if has_snapshot is None:
+            session.add(AssetSnapshot(asset_id=asset_id, version=0, content=await _initial_content(asset)))
+    now = datetime.utcnow()
+    await session.exec(insert(AssetOperation).values([
+        {"asset_id": asset_id, "version": new_version, "seq": seq, "op": op.model_dump_json(), "user_id": user.id, "created_at": now}
+        for seq, op in enumerate(batch.ops)
+    ]))
+    last_snapshot = (await session.exec(
+        select(func.max(AssetSnapshot.version)).where(AssetSnapshot.asset_id == asset_id)
+    )).first() or 0
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Another writer got the same version in first (backends without row locks)
+        await _version_conflict(session, asset_id)
+    if new_version - last_snapshot >= SNAPSHOT_INTERVAL:
+        background_tasks.add_task(compact, asset_id)
+    return SaveResult(asset_id=asset_id, version=new_version)
+
+@router.get("/api/assets/{asset_id}/document", response_model=VectorDocumentOut)
+async def get_document(asset_id: int, session: AsyncSessionDep, version: Optional[int] = None, user: UserSnapshot = Depends(require_user)):
+    asset = await _load_vector_asset(session, user, asset_id)
+    return await load_document(session, asset, version)
+
+@router.get("/api/assets/{asset_id}/history", response_model=List[HistoryEntry])
+async def get_history(asset_id: int, session: AsyncSessionDep, before: Optional[int] = None, limit: int = 50, user: UserSnapshot = Depends(require_user)):
+    await _load_vector_asset(session, user, asset_id)
+    query = (
+        select(AssetOperation.version, func.min(AssetOperation.user_id), func.count(AssetOperation.id), func.min(AssetOperation.created_at))
+        .where(AssetOperation.asset_id == asset_id)
+        .group_by(AssetOperation.version)
+        .order_by(AssetOperation.version.desc())
+        .limit(max(1, min(limit, 200)))
+    )
+    if before is not None:
+        query = query.where(AssetOperation.version < before)
+    rows = (await session.exec(query)).all()
+    return [HistoryEntry(version=version, user_id=user_id, op_count=count, created_at=created_at) for version, user_id, count, created_at in rows]